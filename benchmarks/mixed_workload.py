@@ -0,0 +1,87 @@
+# Смешанная нагрузка: урон боссу, синк профилей и рынок в параллельных потоках.
+# Каждый прогон — отдельный процесс с чистой базой во временной папке (DB_DIR).
+#   python benchmarks/mixed_workload.py --runs 9 --seconds 5
+# Итог: медиана и разброс (min..max) ops/s по каждому виду нагрузки.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KINDS = ["damage"] * 4 + ["sync"] * 2 + ["market"] * 2
+
+
+def single_run(seconds):
+    """Один прогон в текущем процессе, печатает JSON {вид: ops/s}"""
+    os.environ.setdefault("BACKUP_INTERVAL", "0")
+    os.environ.setdefault("SETTLE_INTERVAL", "0")
+    sys.path.insert(0, ROOT)
+    import main
+
+    code = main.create_party(main.PlayerData(user_id="p0", name="A", avatar="x", egg_skin="d"))["partyCode"]
+    conn = main.get_db("party") if "party" in getattr(main, "DB_SHARDS", {}) else main.get_db()
+    conn.execute("UPDATE parties SET boss_hp=1000000000 WHERE code=?", (code,))
+    conn.commit()
+    conn.close()
+
+    counts = {kind: 0 for kind in KINDS}
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def worker(kind, i):
+        n = 0
+        while not stop.is_set():
+            if kind == "damage":
+                main.deal_damage(main.DamageData(code=code, user_id="p0", damage=1))
+            elif kind == "sync":
+                main.sync_global_user(main.GlobalUserSync(user_id=f"u{i}-{n % 50}", name="n", avatar="a",
+                                                          level=1, earned=n, hatched=1))
+            else:
+                lot_id = main.sell_pet(main.MarketLot(seller_id=f"s{i}", seller_name="s", pet_id="cat", pet_stars=1,
+                                                      price=10, currency="coins"))["lot_id"]
+                main.buy_pet(main.BuyRequest(lot_id=lot_id, buyer_id=f"b{i}"))
+            n += 1
+        with lock:
+            counts[kind] += n
+
+    threads = [threading.Thread(target=worker, args=(kind, i)) for i, kind in enumerate(KINDS)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    result = {kind: n / seconds for kind, n in counts.items()}
+    result["total"] = sum(counts.values()) / seconds
+    print(json.dumps(result))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=9)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--single", action="store_true", help="один прогон в этом процессе (DB_DIR задаёт вызывающий)")
+    args = parser.parse_args()
+    if args.single:
+        single_run(args.seconds)
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as db_dir:
+            out = subprocess.run([sys.executable, "-W", "ignore", __file__, "--single", "--seconds", str(args.seconds)],
+                                 env={**os.environ, "DB_DIR": db_dir}, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            print(" ".join(f"{k}={v:.0f}" for k, v in runs[-1].items()), flush=True)
+    for kind in runs[0]:
+        values = [r[kind] for r in runs]
+        print(f"{kind:>7}: median {statistics.median(values):.0f} ops/s, min {min(values):.0f}, max {max(values):.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
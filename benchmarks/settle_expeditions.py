@@ -0,0 +1,84 @@
+# Расчёт экспедиций: один проход settle_expeditions против записи по одной пати.
+# Каждый прогон — отдельный процесс с чистой базой во временной папке (DB_DIR).
+#   python benchmarks/settle_expeditions.py --runs 5 --parties 150000 --expired 100000
+# Итог: медиана и разброс (min..max) по каждой метрике.
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def single_run(parties, expired, sample):
+    """Один прогон в текущем процессе, печатает JSON {метрика: значение}"""
+    os.environ.setdefault("BACKUP_INTERVAL", "0")
+    os.environ.setdefault("SETTLE_INTERVAL", "0")
+    sys.path.insert(0, ROOT)
+    import main
+
+    now = int(time.time())
+    rng = random.Random(35)
+    conn = main.get_db("party")
+    conn.executemany('''INSERT INTO parties (code, boss_hp, boss_max_hp, leader_id, expedition_end, expedition_score,
+                        expedition_location, wolf_hp, wolf_max_hp) VALUES (?, 100, 100, 'u', ?, ?, 'forest', ?, ?)''',
+                     ((f"P{i}", now - rng.randint(1, 3600) if i < expired else now + 3600, rng.randint(1, 60), wolf, wolf)
+                      for i in range(parties) for wolf in [rng.choice([0] * 6 + [20, 40])]))
+    conn.commit()
+    conn.close()
+
+    started = time.perf_counter()
+    settled = main.db_write("party", lambda c: main.settle_expeditions(c, now))
+    batch_ms = (time.perf_counter() - started) * 1000
+    assert settled == expired, settled
+
+    started = time.perf_counter()
+    main.db_write("party", lambda c: main.settle_expeditions(c, now))
+    idle_ms = (time.perf_counter() - started) * 1000
+
+    # Старая модель — отдельная запись на каждую пати (как досчёт в claim), параллельно через того же писателя
+    main.db_write("party", lambda c: c.execute("UPDATE parties SET expedition_settled=0, expedition_result=NULL"))
+    codes = [f"P{i}" for i in rng.sample(range(expired), sample)]
+    per_party_sql = main.SETTLE_SQL + " AND code=?"
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(32) as pool:
+        list(pool.map(lambda code: main.db_write("party", lambda c: c.execute(per_party_sql, (now, code))), codes))
+    per_party_us = (time.perf_counter() - started) / sample * 1e6
+
+    print(json.dumps({"batch_ms": batch_ms, "idle_ms": idle_ms, "per_party_us": per_party_us,
+                      "per_party_s_for_expired": per_party_us * expired / 1e6}))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--parties", type=int, default=150000)
+    parser.add_argument("--expired", type=int, default=100000)
+    parser.add_argument("--sample", type=int, default=10000, help="сколько пати писать по одной (время экстраполируется)")
+    parser.add_argument("--single", action="store_true", help="один прогон в этом процессе (DB_DIR задаёт вызывающий)")
+    args = parser.parse_args()
+    if args.single:
+        single_run(args.parties, args.expired, args.sample)
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as db_dir:
+            out = subprocess.run([sys.executable, "-W", "ignore", __file__, "--single", "--parties", str(args.parties),
+                                  "--expired", str(args.expired), "--sample", str(args.sample)],
+                                 env={**os.environ, "DB_DIR": db_dir}, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            print(" ".join(f"{k}={v:.2f}" for k, v in runs[-1].items()), flush=True)
+    for metric in runs[0]:
+        values = [r[metric] for r in runs]
+        print(f"{metric:>23}: median {statistics.median(values):.2f}, min {min(values):.2f}, max {max(values):.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,13 +1,21 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Union
 import sqlite3
+import json
 import random
 import os
 import time
 import requests
 import uuid
 import asyncio
+import concurrent.futures
+import queue
+import re
+import shutil
+import sys
+import threading
 
 # === ЖЕЛЕЗОБЕТОННАЯ ЗАЩИТА ОТ КРАША СЕРВЕРА ===
 try:
@@ -33,6 +41,13 @@ app.add_middleware(
 active_reactors = {}
 GENES = ['🔴', '🔵', '🟢', '🟡', '🟣']
 
+# Тап-Босс через сокеты: клиент шлёт пачку тапов раз в ~200мс, сервер копит и сливает в БД раз в тик
+active_boss_fights = {}
+BOSS_TICK = float(os.getenv("BOSS_TICK", "0.5"))   # секунд между записью в БД и рассылкой HP
+TAP_MAX_RATE = 20                                  # тапов в секунду на игрока, больше не натапать
+TAP_MAX_DAMAGE = 50                                # урона за один тап
+BOSS_IDLE = float(os.getenv("BOSS_IDLE", "120"))   # бой без тапов столько секунд считается брошенным
+
 if HAS_SOCKETIO:
     sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 
@@ -52,50 +67,220 @@ if HAS_SOCKETIO:
                 if room_id in active_reactors:
                     del active_reactors[room_id]
                 break
+
+    async def boss_tick_task(code):
+        """Фоновый тик Тап-Босса: пачкой пишет урон и рассылает HP. Бой принадлежит задаче, пока он в active_boss_fights"""
+        fight = active_boss_fights.get(code)
+        if not fight:
+            return
+        try:
+            while True:
+                await asyncio.sleep(BOSS_TICK)
+                if active_boss_fights.get(code) is not fight:
+                    break
+                if not fight['pending']:
+                    if time.monotonic() - fight['last_tap'] > BOSS_IDLE:
+                        break   # пати бросила бой — не держим задачу вечно
+                    continue   # нечего писать — не гоняем транзакцию впустую
+
+                pending, fight['pending'] = fight['pending'], {}
+                try:
+                    state = await db_write_async("party", boss_damage_op(code, pending))
+                except Exception as e:
+                    print(f"[boss] ошибка тика {code}: {e}")
+                    # транзакция откатилась — урон вернём в очередь, запишем на следующем тике
+                    for user_id, dmg in pending.items():
+                        fight['pending'][user_id] = fight['pending'].get(user_id, 0) + dmg
+                    continue
+                if not state:
+                    break
+
+                fight['members'] = set(state['players'])
+                fight['tap_budget'] = {u: b for u, b in fight['tap_budget'].items() if u in fight['members']}
+                await sio.emit('bossUpdate', state, room=code)
+                if state['boss_hp'] <= 0:
+                    await sio.emit('bossDefeated', {'result': 'win'}, room=code)
+                    break
+        finally:
+            if active_boss_fights.get(code) is fight:
+                active_boss_fights.pop(code, None)
 else:
     async def reactor_timer_task(room_id):
         pass
 
+    async def boss_tick_task(code):
+        pass
+
 # ==========================================
 # БАЗА ДАННЫХ И ИНИЦИАЛИЗАЦИЯ
 # ==========================================
-DB_PATH = "/data/party.db"
-
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+DB_DIR = os.getenv("DB_DIR", "/data")
+DB_PATH = os.path.join(DB_DIR, "party.db")   # исторический файл, теперь в нём только профили
+
+# Домены живут в отдельных файлах, чтобы урон по боссу не ждал блокировку рынка и профилей
+DB_SHARDS = {
+    "profile": DB_PATH,                                  # global_users, syndicates
+    "party": os.path.join(DB_DIR, "party_state.db"),     # parties, players
+    "social": os.path.join(DB_DIR, "social.db"),         # friends, party_invites
+    "economy": os.path.join(DB_DIR, "economy.db"),       # promo_codes, user_promos, market_*
+}
+SHARD_TABLES = {
+    "profile": ["global_users", "syndicates"],
+    "party": ["parties", "players"],
+    "social": ["friends", "party_invites"],
+    "economy": ["promo_codes", "user_promos", "market_lots", "market_rewards"],
+}
+
+def db_uri(shard, readonly):
+    return f"file:{DB_SHARDS[shard]}" + ("?mode=ro" if readonly else "")
+
+def get_db(shard, attach=(), readonly=False):
+    """Соединение с шардом. attach — шарды для кросс-доменных JOIN (таблицы видны без префикса).
+    readonly — для GET-роутов: такое соединение физически не может взять блокировку записи."""
+    conn = sqlite3.connect(db_uri(shard, readonly), uri=True)
     conn.row_factory = sqlite3.Row
+    for name in attach:
+        conn.execute(f"ATTACH DATABASE ? AS {name}", (db_uri(name, readonly),))
     return conn
 
-def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = get_db()
+# --- Битсеты Батл Пасса и Титулов ---
+# claimed_rewards / unlocked_titles хранятся как BLOB-битсет, номера битов — в bit_keys. Наружу API отдаёт тот же JSON-массив.
+# Бит сам выдаётся только целому ID из 0..BITSET_MAX_ID-1, прочие ID — лишь из каталога (уже есть в bit_keys,
+# пополняется через /api/admin/bitset/register). Клиент не может занять общие биты мусором;
+# массив с ID без бита хранится у этого игрока как JSON-текст.
+BITSET_FIELDS = {"claimed_rewards": "reward", "unlocked_titles": "title"}
+BITSET_MAX_ID = int(os.getenv("BITSET_MAX_ID", "1024"))
+bit_key_cache = {}     # kind -> {bit: json-ключ}
+bit_index_cache = {}   # kind -> {json-ключ: bit}
+
+def reset_bit_caches():
+    """Кэши могли получить биты из откатившейся транзакции — забываем всё, перечитаем из БД"""
+    bit_key_cache.clear()
+    bit_index_cache.clear()
+
+def bit_auto_id(item):
+    return isinstance(item, int) and not isinstance(item, bool) and 0 <= item < BITSET_MAX_ID
+
+def bit_indexes(c, kind, items, register=False):
+    """Номера битов для списка ID; неизвестные ищем одним запросом, новым ID выдаём следующие свободные биты.
+    None — в списке есть ID, которому бит не положен (register=True — админ пополняет каталог)"""
+    keys = [json.dumps(item, sort_keys=True, ensure_ascii=False) for item in items]
+    items_by_key = dict(zip(keys, items))
+    cached = bit_index_cache.setdefault(kind, {})
+    found = {}
+    for key in keys:
+        bit = cached.get(key)
+        if bit is not None:
+            found[key] = bit
+    unknown = [key for key in dict.fromkeys(keys) if key not in found]
+    if unknown:
+        for i in range(0, len(unknown), 500):   # пачками: лимит переменных SQLite бывает 32766
+            chunk = unknown[i:i + 500]
+            c.execute(f"SELECT key, bit FROM bit_keys WHERE kind=? AND key IN ({','.join('?' * len(chunk))})", (kind, *chunk))
+            found.update({row[0]: row[1] for row in c.fetchall()})
+        missing = [key for key in unknown if key not in found]
+        if not register and not all(bit_auto_id(items_by_key[key]) for key in missing):
+            return None
+        if missing:
+            c.execute("SELECT COALESCE(MAX(bit) + 1, 0) FROM bit_keys WHERE kind=?", (kind,))
+            next_bit = c.fetchone()[0]
+            found.update({key: next_bit + i for i, key in enumerate(missing)})
+            c.executemany("INSERT INTO bit_keys (kind, key, bit) VALUES (?, ?, ?)", [(kind, key, found[key]) for key in missing])
+        cached.update({key: found[key] for key in unknown})
+        bit_key_cache.setdefault(kind, {}).update({found[key]: key for key in unknown})
+    return [found[key] for key in keys]
+
+def json_to_bits(c, kind, text):
+    """'[1, 2, "vip"]' -> BLOB. None, если это не JSON-массив или в нём ID без бита (тогда храним как есть в TEXT)"""
+    try:
+        items = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(items, list):
+        return None
+    bits = bit_indexes(c, kind, items)
+    if bits is None:
+        return None
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    return mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+def bits_to_json(c, kind, blob):
+    mask = int.from_bytes(blob or b"", "little")
+    keys = bit_key_cache.setdefault(kind, {})
+    items = []
+    bit = 0
+    while mask:
+        if mask & 1:
+            if bit not in keys:
+                c.execute("SELECT bit, key FROM bit_keys WHERE kind=?", (kind,))
+                keys.update({row[0]: row[1] for row in c.fetchall()})
+            items.append(keys[bit])
+        mask >>= 1
+        bit += 1
+    return "[" + ",".join(items) + "]"
+
+def migrate_bitsets(conn):
+    """Разовый перевод старых JSON-строк в битсеты (строки с *_bits IS NULL)"""
     c = conn.cursor()
-    
-    # Таблицы Пати
-    c.execute('''CREATE TABLE IF NOT EXISTS parties (
-                    code TEXT PRIMARY KEY, boss_hp INTEGER, boss_max_hp INTEGER
-                 )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS players (
-                    user_id TEXT PRIMARY KEY, party_code TEXT, name TEXT, avatar TEXT
-                 )''')
-    
-    party_columns = [
-        ("mega_progress", "INTEGER DEFAULT 0"), ("mega_target", "INTEGER DEFAULT 36000"),
-        ("expedition_end", "INTEGER DEFAULT 0"), ("expedition_score", "INTEGER DEFAULT 0"),
-        ("leader_id", "TEXT DEFAULT ''"), ("active_game", "TEXT DEFAULT 'none'"),
-        ("expedition_location", "TEXT DEFAULT 'forest'"),
-        ("wolf_hp", "INTEGER DEFAULT 0"), ("wolf_max_hp", "INTEGER DEFAULT 0"),
-        ("mega_radar", "INTEGER DEFAULT 0")
-    ]
-    for col, col_type in party_columns:
-        try: c.execute(f"ALTER TABLE parties ADD COLUMN {col} {col_type}")
-        except sqlite3.OperationalError: pass
+    for field, kind in BITSET_FIELDS.items():
+        rows = c.execute(f"SELECT user_id, {field} FROM global_users WHERE {field}_bits IS NULL AND {field} IS NOT NULL").fetchall()
+        for user_id, text in rows:
+            bits = json_to_bits(c, kind, text)
+            if bits is not None:
+                c.execute(f"UPDATE global_users SET {field}_bits=?, {field}=NULL WHERE user_id=?", (bits, user_id))
+    conn.commit()
 
-    # Добавляем поля в players для пати
-    player_columns = [("boss_hp", "INTEGER DEFAULT 0"), ("egg_skin", "TEXT DEFAULT 'default'"), ("equipped_title", "TEXT DEFAULT ''")]
-    for col, col_type in player_columns:
-        try: c.execute(f"ALTER TABLE players ADD COLUMN {col} {col_type}")
-        except sqlite3.OperationalError: pass
+# Полнотекстовый поиск: FTS5 с внешним контентом (имена не дублируются), rowid индекса = rowid исходной строки.
+# таблица -> (FTS-таблица, ключ, индексируемые колонки)
+SEARCH_INDEXES = {
+    "syndicates": ("syndicates_fts", "id", ("name", "tag")),
+    "global_users": ("users_fts", "user_id", ("name",)),
+}
+
+def search_unindex(c, table, key):
+    """Убирает строку из FTS. Вызывать ДО изменения/удаления — FTS5 нужны старые значения колонок"""
+    fts, key_col, cols = SEARCH_INDEXES[table]
+    cols = ", ".join(cols)
+    c.execute(f"INSERT INTO {fts} ({fts}, rowid, {cols}) SELECT 'delete', rowid, {cols} FROM {table} WHERE {key_col}=?", (key,))
+
+def search_index(c, table, key):
+    fts, key_col, cols = SEARCH_INDEXES[table]
+    cols = ", ".join(cols)
+    c.execute(f"INSERT INTO {fts} (rowid, {cols}) SELECT rowid, {cols} FROM {table} WHERE {key_col}=?", (key,))
+
+def rebuild_search_indexes(conn):
+    """Полная перестройка FTS из таблиц. Нужна после миграции и после VACUUM (он перенумеровывает rowid)"""
+    for fts, _, _ in SEARCH_INDEXES.values():
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    conn.commit()
+
+def migrate_legacy_tables(conn, shard):
+    """Разовый перенос таблиц домена из старого общего party.db в свой шард"""
+    conn.execute("ATTACH DATABASE ? AS legacy", (DB_SHARDS["profile"],))
+    for table in SHARD_TABLES[shard]:
+        if not conn.execute("SELECT 1 FROM legacy.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+            continue
+        legacy_cols = {row[1] for row in conn.execute(f"PRAGMA legacy.table_info({table})")}
+        cols = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})") if row[1] in legacy_cols)
+        conn.execute(f"INSERT OR IGNORE INTO main.{table} ({cols}) SELECT {cols} FROM legacy.{table}")
+        conn.execute(f"DROP TABLE legacy.{table}")
+    conn.commit()
+    conn.execute("DETACH DATABASE legacy")
+
+def init_db():
+    os.makedirs(DB_DIR, exist_ok=True)
+
+    # WAL: читатели (в т.ч. бэкап) не блокируют писателей
+    for shard in DB_SHARDS:
+        conn = get_db(shard)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+    # === ПРОФИЛИ ===
+    conn = get_db("profile")
+    c = conn.cursor()
 
     # Таблицы Профиля
     c.execute('''CREATE TABLE IF NOT EXISTS global_users (
@@ -111,12 +296,20 @@ def init_db():
         ("focus_hours", "REAL DEFAULT 0"), ("mythics_crafted", "INTEGER DEFAULT 0"),
         ("reactor_wins", "INTEGER DEFAULT 0"), ("equipped_title", "TEXT DEFAULT ''"),
         ("unlocked_titles", "TEXT DEFAULT '[]'"), ("syndicate_id", "TEXT DEFAULT NULL"),
-        ("syndicate_minutes", "INTEGER DEFAULT 0")
+        ("syndicate_minutes", "INTEGER DEFAULT 0"),
+        ("claimed_rewards_bits", "BLOB DEFAULT NULL"), ("unlocked_titles_bits", "BLOB DEFAULT NULL")
     ]
     for col, col_type in user_columns:
         try: c.execute(f"ALTER TABLE global_users ADD COLUMN {col} {col_type}")
         except sqlite3.OperationalError: pass
 
+    # Словарь ID наград/титулов -> номер бита
+    c.execute('''CREATE TABLE IF NOT EXISTS bit_keys (
+                    kind TEXT, key TEXT, bit INTEGER,
+                    PRIMARY KEY (kind, key), UNIQUE (kind, bit)
+                 )''')
+    migrate_bitsets(conn)
+
     # СИНДИКАТЫ (КЛАНЫ)
     c.execute('''CREATE TABLE IF NOT EXISTS syndicates (
                     id TEXT PRIMARY KEY, name TEXT, tag TEXT, 
@@ -124,6 +317,64 @@ def init_db():
                     level INTEGER DEFAULT 1, avatar TEXT
                  )''')
 
+    # Поиск по имени/тегу синдиката и имени игрока; prefix='2 3' — быстрые запросы по началу слова
+    new_fts = False
+    for table, (fts, _, cols) in SEARCH_INDEXES.items():
+        if not c.execute("SELECT 1 FROM sqlite_master WHERE name=?", (fts,)).fetchone():
+            c.execute(f"""CREATE VIRTUAL TABLE {fts} USING fts5({", ".join(cols)}, content='{table}', content_rowid='rowid',
+                          tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+            new_fts = True
+    if new_fts:
+        rebuild_search_indexes(conn)
+
+    # Индексы под запросы форбса, синдикатов и их участников
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_earned ON global_users (earned)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_syndicate ON global_users (syndicate_id, syndicate_minutes)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_syndicates_minutes ON syndicates (total_minutes)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_syndicates_leader ON syndicates (leader_id)")
+    conn.commit()
+    conn.close()
+
+    # === ПАТИ ===
+    conn = get_db("party")
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS parties (
+                    code TEXT PRIMARY KEY, boss_hp INTEGER, boss_max_hp INTEGER
+                 )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS players (
+                    user_id TEXT PRIMARY KEY, party_code TEXT, name TEXT, avatar TEXT
+                 )''')
+    
+    party_columns = [
+        ("mega_progress", "INTEGER DEFAULT 0"), ("mega_target", "INTEGER DEFAULT 36000"),
+        ("expedition_end", "INTEGER DEFAULT 0"), ("expedition_score", "INTEGER DEFAULT 0"),
+        ("leader_id", "TEXT DEFAULT ''"), ("active_game", "TEXT DEFAULT 'none'"),
+        ("expedition_location", "TEXT DEFAULT 'forest'"),
+        ("wolf_hp", "INTEGER DEFAULT 0"), ("wolf_max_hp", "INTEGER DEFAULT 0"),
+        ("mega_radar", "INTEGER DEFAULT 0"),
+        ("expedition_settled", "INTEGER DEFAULT 0"), ("expedition_result", "TEXT DEFAULT NULL")
+    ]
+    for col, col_type in party_columns:
+        try: c.execute(f"ALTER TABLE parties ADD COLUMN {col} {col_type}")
+        except sqlite3.OperationalError: pass
+
+    # Добавляем поля в players для пати
+    player_columns = [("boss_hp", "INTEGER DEFAULT 0"), ("egg_skin", "TEXT DEFAULT 'default'"), ("equipped_title", "TEXT DEFAULT ''")]
+    for col, col_type in player_columns:
+        try: c.execute(f"ALTER TABLE players ADD COLUMN {col} {col_type}")
+        except sqlite3.OperationalError: pass
+    migrate_legacy_tables(conn, "party")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_players_party ON players (party_code)")
+    # Только нерассчитанные экспедиции — проход расчёта не трогает остальные пати
+    c.execute("CREATE INDEX IF NOT EXISTS idx_parties_unsettled ON parties (expedition_end) WHERE expedition_settled=0")
+    # Волки, которых раньше сбрасывал GET-статус
+    c.execute("UPDATE parties SET wolf_hp=0 WHERE expedition_end=0 AND wolf_hp > 0")
+    conn.commit()
+    conn.close()
+
+    # === СОЦИАЛКА ===
+    conn = get_db("social")
+    c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS friends (
                     user_id TEXT, friend_id TEXT, UNIQUE(user_id, friend_id)
                  )''')
@@ -131,6 +382,14 @@ def init_db():
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     sender_id TEXT, receiver_id TEXT, party_code TEXT, timestamp INTEGER
                  )''')
+    migrate_legacy_tables(conn, "social")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_invites_receiver ON party_invites (receiver_id, sender_id)")
+    conn.commit()
+    conn.close()
+
+    # === ЭКОНОМИКА ===
+    conn = get_db("economy")
+    c = conn.cursor()
 
     # Промокоды
     c.execute('''CREATE TABLE IF NOT EXISTS promo_codes (
@@ -150,6 +409,32 @@ def init_db():
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id TEXT, amount INTEGER, currency TEXT, pet_id TEXT
                  )''')
+    migrate_legacy_tables(conn, "economy")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_market_rewards_user ON market_rewards (user_id)")
+
+    # Аналитика рынка: журнал сделок (только дописывается) + агрегаты, которые обновляются в той же транзакции
+    c.execute('''CREATE TABLE IF NOT EXISTS market_trades (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, lot_id TEXT,
+                    pet_id TEXT, pet_stars INTEGER, currency TEXT, price INTEGER,
+                    seller_id TEXT, buyer_id TEXT, timestamp INTEGER
+                 )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS market_stats (
+                    pet_id TEXT, pet_stars INTEGER, currency TEXT,
+                    last_price INTEGER, last_timestamp INTEGER, min_price INTEGER, max_price INTEGER,
+                    volume INTEGER, turnover INTEGER, median_price INTEGER, median_below INTEGER,
+                    PRIMARY KEY (pet_id, pet_stars, currency)
+                 )''')
+    # Гистограмма цен: сколько сделок прошло по каждой цене (для медианы)
+    c.execute('''CREATE TABLE IF NOT EXISTS market_price_hist (
+                    pet_id TEXT, pet_stars INTEGER, currency TEXT, price INTEGER, cnt INTEGER,
+                    PRIMARY KEY (pet_id, pet_stars, currency, price)
+                 )''')
+    # Часовые корзины для окон 24ч/7д, старше 7 дней удаляются
+    c.execute('''CREATE TABLE IF NOT EXISTS market_hourly (
+                    pet_id TEXT, pet_stars INTEGER, currency TEXT, hour INTEGER,
+                    volume INTEGER, turnover INTEGER, min_price INTEGER, max_price INTEGER,
+                    PRIMARY KEY (pet_id, pet_stars, currency, hour)
+                 )''')
 
     c.execute("SELECT COUNT(*) FROM promo_codes")
     if c.fetchone()[0] == 0:
@@ -160,6 +445,254 @@ def init_db():
 
 init_db()
 
+# ==========================================
+# ЕДИНЫЙ ПИСАТЕЛЬ НА ШАРД (GROUP COMMIT)
+# ==========================================
+WRITER_BATCH = int(os.getenv("WRITER_BATCH", "64"))   # максимум операций в одной транзакции
+writer_rollback_hooks = [reset_bit_caches]             # сброс кэшей, заполненных внутри откатившейся транзакции
+
+class DbWriter:
+    """Один поток на шард забирает операции из очереди и коммитит их пачкой — один fsync на пачку.
+    Каждая операция идёт в своём SAVEPOINT: ошибка одной не откатывает соседей по пачке."""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.queue = queue.Queue()
+        threading.Thread(target=self.run, daemon=True, name=f"db-writer-{shard}").start()
+
+    def submit(self, op):
+        future = concurrent.futures.Future()
+        self.queue.put((op, future))
+        return future
+
+    def run(self):
+        conn = get_db(self.shard)
+        conn.isolation_level = None  # транзакциями управляем сами
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITER_BATCH:
+                try: batch.append(self.queue.get_nowait())
+                except queue.Empty: break
+
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for op, future in batch:
+                    conn.execute("SAVEPOINT op")
+                    try:
+                        results.append((future, op(conn.cursor()), None))
+                        conn.execute("RELEASE op")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO op")
+                        conn.execute("RELEASE op")
+                        results.append((future, None, e))
+                        for hook in writer_rollback_hooks: hook()
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [(future, None, e) for _, future in batch]
+                for hook in writer_rollback_hooks: hook()
+
+            # Отвечаем только после COMMIT — запись уже на диске
+            for future, result, error in results:
+                if error is not None: future.set_exception(error)
+                else: future.set_result(result)
+
+db_writers = {}
+db_writers_lock = threading.Lock()
+
+def get_writer(shard):
+    with db_writers_lock:
+        if shard not in db_writers:
+            db_writers[shard] = DbWriter(shard)
+        return db_writers[shard]
+
+def db_write(shard, op):
+    """Выполняет op(cursor) в потоке-писателе шарда и возвращает её результат (или пробрасывает ошибку)"""
+    return get_writer(shard).submit(op).result()
+
+async def db_write_async(shard, op):
+    return await asyncio.wrap_future(get_writer(shard).submit(op))
+
+# ==========================================
+# РЕЗЕРВНЫЕ КОПИИ (SQLite Online Backup API)
+# ==========================================
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(DB_DIR, "backups"))
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "3600"))         # секунд между снапшотами (0 = выкл)
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "24"))                   # сколько снапшотов хранить (минимум 1)
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "64"))                 # страниц за один шаг копирования
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.02"))   # пауза между шагами, сек
+
+backup_lock = threading.RLock()   # RLock: восстановление делает страховочный снапшот под тем же замком
+
+def backup_files():
+    """Файлы БД, которые попадают в снапшот: {имя в снапшоте: путь}"""
+    return {os.path.basename(path): path for path in DB_SHARDS.values()}
+
+def verify_db_file(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
+def list_snapshots():
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(n for n in os.listdir(BACKUP_DIR) if not n.startswith(".") and os.path.isdir(os.path.join(BACKUP_DIR, n)))
+
+def prune_snapshots(keep=()):
+    """Оставляет BACKUP_KEEP (но не меньше одного) последних снапшотов; имена из keep не трогает никогда"""
+    for name in list_snapshots()[:-max(1, BACKUP_KEEP)]:
+        if name in keep:
+            continue
+        shutil.rmtree(os.path.join(BACKUP_DIR, name), ignore_errors=True)
+
+def make_snapshot(keep=()):
+    """Копирует БД маленькими шагами по BACKUP_PAGES страниц.
+    Источник держит одну читающую транзакцию (снимок WAL): запись других соединений
+    не перезапускает копирование и сама не ждёт бэкапа."""
+    with backup_lock:
+        name = base = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        suffix = 1
+        while os.path.exists(os.path.join(BACKUP_DIR, name)):
+            name = f"{base}-{suffix}"
+            suffix += 1
+        tmp_dir = os.path.join(BACKUP_DIR, "." + name)
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            for fname, path in backup_files().items():
+                dst_path = os.path.join(tmp_dir, fname)
+                src = sqlite3.connect(path, isolation_level=None)
+                dst = sqlite3.connect(dst_path)
+                try:
+                    src.execute("BEGIN")
+                    src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                    src.backup(dst, pages=BACKUP_PAGES, progress=lambda *_: time.sleep(BACKUP_STEP_PAUSE))
+                    dst.execute("PRAGMA journal_mode=DELETE")  # снапшот — один самодостаточный файл
+                finally:
+                    dst.close()
+                    src.close()
+                if not verify_db_file(dst_path):
+                    raise sqlite3.DatabaseError(f"Снапшот {fname} не прошёл integrity_check")
+            os.rename(tmp_dir, os.path.join(BACKUP_DIR, name))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        prune_snapshots(keep)
+        return name
+
+def verify_snapshot(name):
+    snap_dir = os.path.join(BACKUP_DIR, name)
+    return {fname: os.path.exists(os.path.join(snap_dir, fname)) and verify_db_file(os.path.join(snap_dir, fname))
+            for fname in backup_files()}
+
+def restore_snapshot(name):
+    """Перезаливает живые БД из снапшота. Перед этим делает свежий снапшот, чтобы откат был обратим."""
+    with backup_lock:
+        if name not in list_snapshots():
+            raise ValueError("Снапшот не найден")
+        checks = verify_snapshot(name)
+        if not all(checks.values()):
+            raise ValueError(f"Снапшот повреждён: {checks}")
+        make_snapshot(keep=(name,))   # восстанавливаемый снапшот не должен уйти под ротацию
+        for fname, path in backup_files().items():
+            src = sqlite3.connect(os.path.join(BACKUP_DIR, name, fname))
+            dst = sqlite3.connect(path)
+            try:
+                src.backup(dst)
+                dst.execute("PRAGMA journal_mode=WAL")
+            finally:
+                dst.close()
+                src.close()
+        reset_bit_caches()   # в кэше номера битов из живой БД, в снапшоте их может не быть
+
+async def backup_scheduler_task():
+    """Фоновый цикл резервного копирования"""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        try:
+            await asyncio.to_thread(make_snapshot)
+        except Exception as e:
+            print(f"[backup] ошибка снапшота: {e}")
+
+@app.on_event("startup")
+async def start_backup_scheduler():
+    if BACKUP_INTERVAL > 0:
+        asyncio.create_task(backup_scheduler_task())
+
+# ==========================================
+# ДОПУСК ЗАПРОСОВ (RATE LIMIT + СБРОС НАГРУЗКИ)
+# ==========================================
+# класс роута -> (токенов/сек на игрока, размер бакета, одновременно в работе, максимум ждущих слота)
+ADMISSION_LIMITS = {
+    "damage":  (20, 40, 8, 8),
+    "promo":   (0.5, 3, 4, 4),
+    "market":  (3, 10, 4, 4),
+    "profile": (5, 20, 8, 8),
+}
+ADMISSION_LIMITS.update({k: tuple(v) for k, v in json.loads(os.getenv("ADMISSION_LIMITS", "{}")).items()})
+ADMISSION_WAIT = float(os.getenv("ADMISSION_WAIT", "1.0"))   # сколько ждать свободный слот, сек
+ADMISSION_IDLE = 300                                         # бакеты молчащих игроков забываем через 5 мин
+
+admission_lock = threading.Lock()
+token_buckets = {}   # (класс, user_id) -> (токены, время)
+route_slots = {route: asyncio.Semaphore(limits[2]) for route, limits in ADMISSION_LIMITS.items()}
+route_waiting = {route: 0 for route in ADMISSION_LIMITS}
+admission_stats = {route: {"admitted": 0, "rate_limited": 0, "shed": 0} for route in ADMISSION_LIMITS}
+last_bucket_sweep = time.monotonic()
+
+def take_token(route, user_id, rate, burst, now):
+    global last_bucket_sweep
+    if now - last_bucket_sweep > ADMISSION_IDLE:
+        for key in [k for k, (_, seen) in token_buckets.items() if now - seen > ADMISSION_IDLE]:
+            del token_buckets[key]
+        last_bucket_sweep = now
+    tokens, seen = token_buckets.get((route, user_id), (burst, now))
+    tokens = min(burst, tokens + (now - seen) * rate)
+    if tokens < 1:
+        token_buckets[(route, user_id)] = (tokens, now)
+        return False
+    token_buckets[(route, user_id)] = (tokens - 1, now)
+    return True
+
+def admission(route, user_field="user_id"):
+    """Проверка в event loop ДО пула потоков: лишние запросы не занимают потоки и не стоят в очереди к БД.
+    429 — игрок превысил свой бюджет, 503 — класс роута перегружен"""
+    rate, burst, _, max_waiting = ADMISSION_LIMITS[route]
+    stats = admission_stats[route]
+
+    async def guard(request: Request):
+        try: user_id = str((await request.json()).get(user_field, ""))
+        except Exception: user_id = ""   # кривое тело отвалится на валидации с 422
+        with admission_lock:
+            if not take_token(route, user_id, rate, burst, time.monotonic()):
+                stats["rate_limited"] += 1
+                raise HTTPException(status_code=429, detail="Слишком много запросов, притормози")
+            if route_waiting[route] >= max_waiting:
+                stats["shed"] += 1
+                raise HTTPException(status_code=503, detail="Сервер перегружен, попробуй позже")
+            route_waiting[route] += 1
+        try:
+            await asyncio.wait_for(route_slots[route].acquire(), ADMISSION_WAIT)
+            acquired = True
+        except asyncio.TimeoutError:
+            acquired = False
+        with admission_lock:
+            route_waiting[route] -= 1
+            stats["admitted" if acquired else "shed"] += 1
+        if not acquired:
+            raise HTTPException(status_code=503, detail="Сервер перегружен, попробуй позже")
+        try:
+            yield
+        finally:
+            route_slots[route].release()
+
+    return Depends(guard)
+
 # --- МОДЕЛИ ---
 class PlayerData(BaseModel): 
     user_id: str
@@ -179,6 +712,8 @@ class ExpeditionStartData(BaseModel): code: str; location: str
 class InvoiceData(BaseModel): amount: int; user_id: str
 class PromoRequest(BaseModel): user_id: str; code: str
 class AdminPromoCreate(BaseModel): password: str; code: str; type: str; val: int; max_uses: int
+class AdminAuth(BaseModel): password: str
+class AdminSnapshot(BaseModel): password: str; name: str
 class MarketLot(BaseModel): seller_id: str; seller_name: str; pet_id: str; pet_stars: int; price: int; currency: str
 class BuyRequest(BaseModel): lot_id: str; buyer_id: str
 
@@ -200,6 +735,10 @@ class GlobalUserSync(BaseModel):
     equipped_title: str = ""
     unlocked_titles: str = "[]"
 
+class RewardClaim(BaseModel): user_id: str; reward_id: Union[int, str]
+class TitleUnlock(BaseModel): user_id: str; title_id: Union[int, str]
+class AdminBitKeys(BaseModel): password: str; kind: str; keys: List[Union[int, str]]
+
 class SyndicateCreate(BaseModel): user_id: str; name: str; tag: str; avatar: str
 class SyndicateJoin(BaseModel): user_id: str; syndicate_id: str
 class SyndicateLeave(BaseModel): user_id: str
@@ -212,6 +751,19 @@ class MutateRequest(BaseModel):
     pet2_stars: int
     catalyst: str
 
+# ==========================================
+# ТАБЛИЦЫ ПИТОМЦЕВ (считаются один раз при старте)
+# ==========================================
+LEGENDARY_PETS = frozenset(["unicorn", "dragon", "alien", "robot", "dino", "fireball", "god"])
+RARE_PETS = frozenset(["fox", "panda", "tiger", "lion", "cow", "pig", "monkey", "owl"])
+FARM_PETS = frozenset(["cow", "pig", "duck"])
+PREDATOR_PETS = frozenset(["kitten", "tiger", "lion", "fox"])
+# аватар -> (очки экспедиции, ферма?, хищник?); кого нет в таблице — (1, False, False)
+AVATAR_TRAITS = {av: (10 if av in LEGENDARY_PETS else 3 if av in RARE_PETS else 1, av in FARM_PETS, av in PREDATOR_PETS)
+                 for av in LEGENDARY_PETS | RARE_PETS | FARM_PETS | PREDATOR_PETS}
+DEFAULT_TRAITS = (1, False, False)
+EXPEDITION_TIME = {"forest": 5 * 60, "mountains": 15 * 60, "space": 25 * 60}   # неизвестная локация = лес
+
 # ==========================================
 # СЕКРЕТНЫЕ МУТАЦИИ (КРАФТ)
 # ==========================================
@@ -224,8 +776,6 @@ def secret_mutate(data: MutateRequest):
     p2_s = data.pet2_stars
     cat = data.catalyst
 
-    legendary_pets = ["unicorn", "dragon", "alien", "robot", "dino", "fireball", "god"]
-
     # Рецепт 1: Свинья (⭐️3+) + Робот + Джокер (Ген) = Кибер-Хрюшка
     if cat == "joker":
         if (p1 == "pig" and p1_s >= 3 and p2 == "robot") or (p2 == "pig" and p2_s >= 3 and p1 == "robot"):
@@ -233,7 +783,7 @@ def secret_mutate(data: MutateRequest):
             
     # Рецепт 2: Гусеница + Любая Легендарка + Шприц (bio) = Токсичная Гусеница (Гамма-Ящер как аналог)
     if cat == "bio":
-        if (p1 == "caterpillar" and p2 in legendary_pets) or (p2 == "caterpillar" and p1 in legendary_pets):
+        if (p1 == "caterpillar" and p2 in LEGENDARY_PETS) or (p2 == "caterpillar" and p1 in LEGENDARY_PETS):
             return {"status": "success", "result_pet": "mutant_dragon", "consumed_pets": True, "message": "Токсичная реакция успешна!"}
 
     # Рецепт 3: Кот + Кот + Зелье Удачи (luck) = Квантовый Кот (Кибер-кот как аналог)
@@ -250,111 +800,100 @@ def secret_mutate(data: MutateRequest):
 @app.post("/api/syndicates/create")
 @app.post("/api/api/syndicates/create")
 def create_syndicate(data: SyndicateCreate):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
-    row = c.fetchone()
-    if row and row['syndicate_id']:
-        conn.close()
-        return {"status": "error", "detail": "Вы уже состоите в Синдикате!"}
+    def op(c):
+        c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
+        row = c.fetchone()
+        if row and row['syndicate_id']:
+            return {"status": "error", "detail": "Вы уже состоите в Синдикате!"}
     
-    syn_id = str(uuid.uuid4())[:8].upper()
-    c.execute("INSERT INTO syndicates (id, name, tag, leader_id, avatar) VALUES (?, ?, ?, ?, ?)",
-              (syn_id, data.name, data.tag, data.user_id, data.avatar))
+        syn_id = str(uuid.uuid4())[:8].upper()
+        c.execute("INSERT INTO syndicates (id, name, tag, leader_id, avatar) VALUES (?, ?, ?, ?, ?)",
+                  (syn_id, data.name, data.tag, data.user_id, data.avatar))
+        search_index(c, "syndicates", syn_id)
               
-    c.execute("UPDATE global_users SET syndicate_id=?, syndicate_minutes=0 WHERE user_id=?", (syn_id, data.user_id))
-    conn.commit()
-    conn.close()
-    return {"status": "success", "syndicate_id": syn_id}
+        c.execute("UPDATE global_users SET syndicate_id=?, syndicate_minutes=0 WHERE user_id=?", (syn_id, data.user_id))
+        return {"status": "success", "syndicate_id": syn_id}
+    return db_write("profile", op)
 
 @app.post("/api/syndicates/join")
 @app.post("/api/api/syndicates/join")
 def join_syndicate(data: SyndicateJoin):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
-    row = c.fetchone()
-    if row and row['syndicate_id']:
-        conn.close()
-        return {"status": "error", "detail": "Вы уже состоите в Синдикате!"}
+    def op(c):
+        c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
+        row = c.fetchone()
+        if row and row['syndicate_id']:
+            return {"status": "error", "detail": "Вы уже состоите в Синдикате!"}
         
-    c.execute("SELECT * FROM syndicates WHERE id=?", (data.syndicate_id,))
-    if not c.fetchone():
-        conn.close()
-        return {"status": "error", "detail": "Синдикат не найден"}
+        c.execute("SELECT * FROM syndicates WHERE id=?", (data.syndicate_id,))
+        if not c.fetchone():
+            return {"status": "error", "detail": "Синдикат не найден"}
     
-    c.execute("SELECT COUNT(*) FROM global_users WHERE syndicate_id=?", (data.syndicate_id,))
-    if c.fetchone()[0] >= 50:
-        conn.close()
-        return {"status": "error", "detail": "Синдикат заполнен (макс 50 участников)"}
+        c.execute("SELECT COUNT(*) FROM global_users WHERE syndicate_id=?", (data.syndicate_id,))
+        if c.fetchone()[0] >= 50:
+            return {"status": "error", "detail": "Синдикат заполнен (макс 50 участников)"}
         
-    c.execute("UPDATE global_users SET syndicate_id=?, syndicate_minutes=0 WHERE user_id=?", (data.syndicate_id, data.user_id))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+        c.execute("UPDATE global_users SET syndicate_id=?, syndicate_minutes=0 WHERE user_id=?", (data.syndicate_id, data.user_id))
+        return {"status": "success"}
+    return db_write("profile", op)
 
 @app.post("/api/syndicates/leave")
 @app.post("/api/api/syndicates/leave")
 def leave_syndicate(data: SyndicateLeave):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
-    row = c.fetchone()
-    if row and row['syndicate_id']:
-        syn_id = row['syndicate_id']
-        c.execute("SELECT leader_id FROM syndicates WHERE id=?", (syn_id,))
-        syn = c.fetchone()
+    def op(c):
+        c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
+        row = c.fetchone()
+        if row and row['syndicate_id']:
+            syn_id = row['syndicate_id']
+            c.execute("SELECT leader_id FROM syndicates WHERE id=?", (syn_id,))
+            syn = c.fetchone()
         
-        if syn and syn['leader_id'] == data.user_id:
-            c.execute("UPDATE global_users SET syndicate_id=NULL, syndicate_minutes=0 WHERE syndicate_id=?", (syn_id,))
-            c.execute("DELETE FROM syndicates WHERE id=?", (syn_id,))
-        else:
-            c.execute("UPDATE global_users SET syndicate_id=NULL, syndicate_minutes=0 WHERE user_id=?", (data.user_id,))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+            if syn and syn['leader_id'] == data.user_id:
+                c.execute("UPDATE global_users SET syndicate_id=NULL, syndicate_minutes=0 WHERE syndicate_id=?", (syn_id,))
+                search_unindex(c, "syndicates", syn_id)
+                c.execute("DELETE FROM syndicates WHERE id=?", (syn_id,))
+            else:
+                c.execute("UPDATE global_users SET syndicate_id=NULL, syndicate_minutes=0 WHERE user_id=?", (data.user_id,))
+        return {"status": "success"}
+    return db_write("profile", op)
 
 @app.post("/api/syndicates/edit")
 @app.post("/api/api/syndicates/edit")
 def edit_syndicate(data: SyndicateCreate):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT id, leader_id FROM syndicates WHERE leader_id=?", (data.user_id,))
-    syn = c.fetchone()
-    if not syn:
-        conn.close()
-        return {"status": "error", "detail": "Вы не лидер Синдиката!"}
+    def op(c):
+        c.execute("SELECT id, leader_id FROM syndicates WHERE leader_id=?", (data.user_id,))
+        syn = c.fetchone()
+        if not syn:
+            return {"status": "error", "detail": "Вы не лидер Синдиката!"}
         
-    c.execute("UPDATE syndicates SET name=?, tag=?, avatar=? WHERE id=?", (data.name, data.tag, data.avatar, syn['id']))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+        search_unindex(c, "syndicates", syn['id'])
+        c.execute("UPDATE syndicates SET name=?, tag=?, avatar=? WHERE id=?", (data.name, data.tag, data.avatar, syn['id']))
+        search_index(c, "syndicates", syn['id'])
+        return {"status": "success"}
+    return db_write("profile", op)
 
 @app.post("/api/syndicates/add_minutes")
 @app.post("/api/api/syndicates/add_minutes")
 def syndicate_add_minutes(data: SyndicateAddMinutes):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
-    row = c.fetchone()
-    if row and row['syndicate_id']:
-        syn_id = row['syndicate_id']
-        c.execute("UPDATE global_users SET syndicate_minutes = syndicate_minutes + ? WHERE user_id=?", (data.minutes, data.user_id))
-        c.execute("UPDATE syndicates SET total_minutes = total_minutes + ? WHERE id=?", (data.minutes, syn_id))
+    def op(c):
+        c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (data.user_id,))
+        row = c.fetchone()
+        if row and row['syndicate_id']:
+            syn_id = row['syndicate_id']
+            c.execute("UPDATE global_users SET syndicate_minutes = syndicate_minutes + ? WHERE user_id=?", (data.minutes, data.user_id))
+            c.execute("UPDATE syndicates SET total_minutes = total_minutes + ? WHERE id=?", (data.minutes, syn_id))
         
-        c.execute("SELECT total_minutes FROM syndicates WHERE id=?", (syn_id,))
-        tm = c.fetchone()['total_minutes']
-        new_lvl = max(1, min(100, tm // 1000 + 1))
-        c.execute("UPDATE syndicates SET level=? WHERE id=?", (new_lvl, syn_id))
+            c.execute("SELECT total_minutes FROM syndicates WHERE id=?", (syn_id,))
+            tm = c.fetchone()['total_minutes']
+            new_lvl = max(1, min(100, tm // 1000 + 1))
+            c.execute("UPDATE syndicates SET level=? WHERE id=?", (new_lvl, syn_id))
         
-        conn.commit()
-    conn.close()
-    return {"status": "success"}
+        return {"status": "success"}
+    return db_write("profile", op)
 
 @app.get("/api/syndicates/top")
 @app.get("/api/api/syndicates/top")
 def get_top_syndicates():
-    conn = get_db()
+    conn = get_db("profile", readonly=True)
     c = conn.cursor()
     c.execute("SELECT * FROM syndicates ORDER BY total_minutes DESC LIMIT 20")
     syndicates = [dict(row) for row in c.fetchall()]
@@ -367,7 +906,7 @@ def get_top_syndicates():
 @app.get("/api/syndicates/info/{syndicate_id}")
 @app.get("/api/api/syndicates/info/{syndicate_id}")
 def get_syndicate_info(syndicate_id: str):
-    conn = get_db()
+    conn = get_db("profile", readonly=True)
     c = conn.cursor()
     c.execute("SELECT * FROM syndicates WHERE id=?", (syndicate_id,))
     syn = c.fetchone()
@@ -383,7 +922,7 @@ def get_syndicate_info(syndicate_id: str):
 @app.get("/api/syndicates/my/{user_id}")
 @app.get("/api/api/syndicates/my/{user_id}")
 def get_my_syndicate(user_id: str):
-    conn = get_db()
+    conn = get_db("profile", readonly=True)
     c = conn.cursor()
     c.execute("SELECT syndicate_id FROM global_users WHERE user_id=?", (user_id,))
     row = c.fetchone()
@@ -394,69 +933,211 @@ def get_my_syndicate(user_id: str):
 
 
 # ==========================================
-# РЫНОК
+# ПОИСК (FTS5)
 # ==========================================
-@app.post("/api/market/sell")
-@app.post("/api/api/market/sell") 
-def sell_pet(lot: MarketLot):
-    conn = get_db()
+SEARCH_PAGE = 20
+SEARCH_MAX_PAGE = 10
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "2000"))              # совпадений по префиксу ранжируем по bm25
+SEARCH_EXACT_CANDIDATES = int(os.getenv("SEARCH_EXACT_CANDIDATES", "10000"))  # точных совпадений слов — тоже
+
+def fts_query(text):
+    """Ввод игрока -> пара запросов FTS5 (точный, префиксный): слова в кавычках (никакого синтаксиса MATCH снаружи),
+    в префиксном последнее слово — по префиксу. Дописанные слова ищем точно: префикс по частому слову («player*»)
+    собирает огромный список и тормозит"""
+    words = re.findall(r"\w+", text.lower())[:5]
+    if not words or sum(map(len, words)) < 2:
+        return None
+    exact = " ".join(f'"{w}"' for w in words)
+    return exact, exact + "*"
+
+def search_rows(c, sql, fts, weights, q, page):
+    """Сначала точные совпадения слов: до SEARCH_EXACT_CANDIDATES штук, по bm25 — «Alex» не теряется за тысячами
+    «Alex …». Не хватило на страницу — добираем по префиксу из первых SEARCH_CANDIDATES совпадений:
+    полная сортировка широкого префикса («pl») стоила бы секунды"""
+    match = fts_query(q)
+    if match is None:
+        return None
+    exact, prefix = match
+    page = max(0, min(page, SEARCH_MAX_PAGE))
+    need = (page + 1) * SEARCH_PAGE + 1
+
+    def hits(query, candidates, limit):
+        c.execute(f"""WITH hits AS (SELECT rowid, bm25({fts}, {weights}) AS score FROM {fts} WHERE {fts} MATCH ? LIMIT ?)
+                      {sql} ORDER BY hits.score LIMIT ?""", (query, candidates, limit))
+        return [dict(row) for row in c.fetchall()]
+
+    rows = hits(exact, SEARCH_EXACT_CANDIDATES, need)
+    if len(rows) < need:
+        rows += [row for row in hits(prefix, SEARCH_CANDIDATES, need + len(rows)) if row not in rows]
+    rows = rows[page * SEARCH_PAGE:need]
+    return {"status": "success", "page": page, "has_more": len(rows) > SEARCH_PAGE and page < SEARCH_MAX_PAGE,
+            "results": rows[:SEARCH_PAGE]}
+
+@app.get("/api/search/syndicates")
+@app.get("/api/api/search/syndicates")
+def search_syndicates(q: str, page: int = 0):
+    conn = get_db("profile", readonly=True)
     c = conn.cursor()
-    lot_id = str(uuid.uuid4())
-    c.execute("INSERT INTO market_lots (lot_id, seller_id, seller_name, pet_id, pet_stars, price, currency) VALUES (?, ?, ?, ?, ?, ?, ?)",
-              (lot_id, lot.seller_id, lot.seller_name, lot.pet_id, lot.pet_stars, lot.price, lot.currency))
-    conn.commit()
+    result = search_rows(c, """SELECT s.id, s.name, s.tag, s.avatar, s.level, s.total_minutes,
+                                      (SELECT COUNT(*) FROM global_users g WHERE g.syndicate_id = s.id) AS members
+                               FROM hits JOIN syndicates s ON s.rowid = hits.rowid""",
+                         "syndicates_fts", "1.0, 2.0", q, page)   # совпадение по тегу весит больше
+    conn.close()
+    return result or {"status": "error", "detail": "Минимум 2 символа для поиска"}
+
+@app.get("/api/search/players")
+@app.get("/api/api/search/players")
+def search_players(q: str, page: int = 0):
+    conn = get_db("profile", readonly=True)
+    c = conn.cursor()
+    result = search_rows(c, """SELECT g.user_id, g.name, g.avatar, g.level, g.equipped_title, s.tag AS syndicate_tag
+                               FROM hits JOIN global_users g ON g.rowid = hits.rowid
+                               LEFT JOIN syndicates s ON g.syndicate_id = s.id""",
+                         "users_fts", "1.0", q, page)
+    conn.close()
+    return result or {"status": "error", "detail": "Минимум 2 символа для поиска"}
+
+# ==========================================
+# АНАЛИТИКА РЫНКА
+# ==========================================
+STATS_WINDOWS = {"24h": 24, "7d": 24 * 7}   # окно -> часов
+STATS_KEEP_HOURS = max(STATS_WINDOWS.values())
+
+def record_trade(c, lot, buyer_id, now=None):
+    """Пишет сделку в журнал и обновляет агрегаты ключа (пет, звёзды, валюта) — без сканов истории.
+    Медиана (нижняя) хранится вместе с числом сделок дешевле неё: одна сделка сдвигает её максимум на одну цену"""
+    now = int(time.time()) if now is None else now
+    key = (lot["pet_id"], lot["pet_stars"], lot["currency"])
+    price = lot["price"]
+    c.execute("INSERT INTO market_trades (lot_id, pet_id, pet_stars, currency, price, seller_id, buyer_id, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+              (lot["lot_id"], *key, price, lot["seller_id"], buyer_id, now))
+    c.execute('''INSERT INTO market_price_hist (pet_id, pet_stars, currency, price, cnt) VALUES (?, ?, ?, ?, 1)
+                 ON CONFLICT(pet_id, pet_stars, currency, price) DO UPDATE SET cnt = cnt + 1''', (*key, price))
+
+    hour = now // 3600
+    c.execute('''INSERT INTO market_hourly (pet_id, pet_stars, currency, hour, volume, turnover, min_price, max_price)
+                 VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+                 ON CONFLICT(pet_id, pet_stars, currency, hour) DO UPDATE SET
+                 volume = volume + 1, turnover = turnover + excluded.turnover,
+                 min_price = MIN(min_price, excluded.min_price), max_price = MAX(max_price, excluded.max_price)''',
+              (*key, hour, price, price, price))
+    c.execute("DELETE FROM market_hourly WHERE pet_id=? AND pet_stars=? AND currency=? AND hour <= ?", (*key, hour - STATS_KEEP_HOURS))
+
+    c.execute("SELECT volume, median_price, median_below FROM market_stats WHERE pet_id=? AND pet_stars=? AND currency=?", key)
+    st = c.fetchone()
+    if not st:
+        c.execute('''INSERT INTO market_stats (pet_id, pet_stars, currency, last_price, last_timestamp, min_price, max_price,
+                     volume, turnover, median_price, median_below) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?, 0)''',
+                  (*key, price, now, price, price, price, price))
+        return
+
+    volume = st["volume"] + 1
+    median, below = st["median_price"], st["median_below"] + (price < st["median_price"])
+    rank = (volume - 1) // 2   # номер медианной сделки в отсортированном списке, с нуля
+    if rank < below:
+        c.execute("SELECT price, cnt FROM market_price_hist WHERE pet_id=? AND pet_stars=? AND currency=? AND price < ? ORDER BY price DESC LIMIT 1", (*key, median))
+        median, cnt = c.fetchone()
+        below -= cnt
+    else:
+        c.execute("SELECT cnt FROM market_price_hist WHERE pet_id=? AND pet_stars=? AND currency=? AND price=?", (*key, median))
+        cnt = c.fetchone()[0]
+        if rank >= below + cnt:
+            c.execute("SELECT price FROM market_price_hist WHERE pet_id=? AND pet_stars=? AND currency=? AND price > ? ORDER BY price LIMIT 1", (*key, median))
+            median, below = c.fetchone()[0], below + cnt
+
+    c.execute('''UPDATE market_stats SET last_price=?, last_timestamp=?, min_price=MIN(min_price, ?), max_price=MAX(max_price, ?),
+                 volume=?, turnover=turnover + ?, median_price=?, median_below=?
+                 WHERE pet_id=? AND pet_stars=? AND currency=?''',
+              (price, now, price, price, volume, price, median, below, *key))
+
+@app.get("/api/market/stats")
+@app.get("/api/api/market/stats")
+def get_market_stats(pet_id: str, pet_stars: Union[int, None] = None, currency: Union[str, None] = None):
+    conn = get_db("economy", readonly=True)
+    c = conn.cursor()
+    sql, params = "SELECT * FROM market_stats WHERE pet_id=?", [pet_id]
+    if pet_stars is not None:
+        sql, params = sql + " AND pet_stars=?", params + [pet_stars]
+    if currency is not None:
+        sql, params = sql + " AND currency=?", params + [currency]
+    c.execute(sql, params)
+    rows = c.fetchall()
+
+    hour = int(time.time()) // 3600
+    stats = []
+    for row in rows:
+        item = {"pet_id": row["pet_id"], "pet_stars": row["pet_stars"], "currency": row["currency"],
+                "last_price": row["last_price"], "last_timestamp": row["last_timestamp"],
+                "min": row["min_price"], "median": row["median_price"], "max": row["max_price"],
+                "volume": row["volume"], "avg": round(row["turnover"] / row["volume"], 2)}
+        # Окна собираются из часовых корзин: не больше STATS_KEEP_HOURS строк на ключ
+        for window, hours in STATS_WINDOWS.items():
+            c.execute('''SELECT COALESCE(SUM(volume), 0), COALESCE(SUM(turnover), 0), MIN(min_price), MAX(max_price)
+                         FROM market_hourly WHERE pet_id=? AND pet_stars=? AND currency=? AND hour > ?''',
+                      (row["pet_id"], row["pet_stars"], row["currency"], hour - hours))
+            volume, turnover, low, high = c.fetchone()
+            item[window] = {"volume": volume, "min": low, "max": high, "avg": round(turnover / volume, 2) if volume else None}
+        stats.append(item)
     conn.close()
-    return {"status": "success", "lot_id": lot_id}
+    return {"status": "success", "stats": stats}
+
+# ==========================================
+# РЫНОК
+# ==========================================
+@app.post("/api/market/sell", dependencies=[admission("market", "seller_id")])
+@app.post("/api/api/market/sell", dependencies=[admission("market", "seller_id")])
+def sell_pet(lot: MarketLot):
+    def op(c):
+        lot_id = str(uuid.uuid4())
+        c.execute("INSERT INTO market_lots (lot_id, seller_id, seller_name, pet_id, pet_stars, price, currency) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (lot_id, lot.seller_id, lot.seller_name, lot.pet_id, lot.pet_stars, lot.price, lot.currency))
+        return {"status": "success", "lot_id": lot_id}
+    return db_write("economy", op)
 
 @app.get("/api/market/list")
 @app.get("/api/api/market/list")
 def get_market():
-    conn = get_db()
+    conn = get_db("economy", readonly=True)
     c = conn.cursor()
     c.execute("SELECT * FROM market_lots ORDER BY rowid DESC") 
     lots = [dict(row) for row in c.fetchall()]
     conn.close()
     return {"lots": lots}
 
-@app.post("/api/market/buy")
-@app.post("/api/api/market/buy")
+@app.post("/api/market/buy", dependencies=[admission("market", "buyer_id")])
+@app.post("/api/api/market/buy", dependencies=[admission("market", "buyer_id")])
 def buy_pet(req: BuyRequest):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM market_lots WHERE lot_id=?", (req.lot_id,))
-    lot = c.fetchone()
+    def op(c):
+        c.execute("SELECT * FROM market_lots WHERE lot_id=?", (req.lot_id,))
+        lot = c.fetchone()
     
-    if not lot:
-        conn.close()
-        return {"status": "error", "detail": "Лот не найден или уже куплен"}
+        if not lot:
+            return {"status": "error", "detail": "Лот не найден или уже куплен"}
     
-    if lot["seller_id"] == req.buyer_id:
-        conn.close()
-        return {"status": "error", "detail": "Нельзя купить своего пета"}
+        if lot["seller_id"] == req.buyer_id:
+            return {"status": "error", "detail": "Нельзя купить своего пета"}
         
-    c.execute("DELETE FROM market_lots WHERE lot_id=?", (req.lot_id,))
+        c.execute("DELETE FROM market_lots WHERE lot_id=?", (req.lot_id,))
+        record_trade(c, lot, req.buyer_id)
     
-    c.execute("INSERT INTO market_rewards (user_id, amount, currency, pet_id) VALUES (?, ?, ?, ?)",
-              (lot["seller_id"], lot["price"], lot["currency"], lot["pet_id"]))
+        c.execute("INSERT INTO market_rewards (user_id, amount, currency, pet_id) VALUES (?, ?, ?, ?)",
+                  (lot["seller_id"], lot["price"], lot["currency"], lot["pet_id"]))
               
-    conn.commit()
-    conn.close()
-    return {"status": "success", "lot": dict(lot)}
+        return {"status": "success", "lot": dict(lot)}
+    return db_write("economy", op)
 
 @app.get("/api/market/rewards/{user_id}")
 @app.get("/api/api/market/rewards/{user_id}")
 def check_market_rewards(user_id: str):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM market_rewards WHERE user_id=?", (user_id,))
-    rewards = [dict(row) for row in c.fetchall()]
+    def op(c):
+        c.execute("SELECT * FROM market_rewards WHERE user_id=?", (user_id,))
+        rewards = [dict(row) for row in c.fetchall()]
     
-    if rewards:
-        c.execute("DELETE FROM market_rewards WHERE user_id=?", (user_id,))
-        conn.commit()
+        if rewards:
+            c.execute("DELETE FROM market_rewards WHERE user_id=?", (user_id,))
         
-    conn.close()
-    return {"rewards": rewards}
+        return {"rewards": rewards}
+    return db_write("economy", op)
 
 # ==========================================
 # ОСТАЛЬНЫЕ ФУНКЦИИ
@@ -464,7 +1145,7 @@ def check_market_rewards(user_id: str):
 @app.get("/api/forbes/{user_id}")
 @app.get("/api/api/forbes/{user_id}")
 def get_forbes(user_id: str):
-    conn = get_db()
+    conn = get_db("profile", attach=("social",), readonly=True)
     c = conn.cursor()
     c.execute('''SELECT global_users.user_id, global_users.name, global_users.avatar, global_users.earned, 
                  global_users.level, global_users.hatched, global_users.active_theme, global_users.showcase, 
@@ -500,40 +1181,77 @@ def get_forbes(user_id: str):
 @app.post("/api/admin/promo/create")
 def admin_create_promo(data: AdminPromoCreate):
     if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
-    conn = get_db()
-    c = conn.cursor()
-    code_upper = data.code.upper().strip()
-    c.execute("SELECT * FROM promo_codes WHERE code=?", (code_upper,))
-    if c.fetchone():
-        conn.close()
-        return {"status": "error", "detail": "Код уже существует!"}
-    c.execute("INSERT INTO promo_codes (code, type, val, max_uses, uses) VALUES (?, ?, ?, ?, 0)", (code_upper, data.type, data.val, data.max_uses))
-    conn.commit()
-    conn.close()
+    def op(c):
+        code_upper = data.code.upper().strip()
+        c.execute("SELECT * FROM promo_codes WHERE code=?", (code_upper,))
+        if c.fetchone():
+            return {"status": "error", "detail": "Код уже существует!"}
+        c.execute("INSERT INTO promo_codes (code, type, val, max_uses, uses) VALUES (?, ?, ?, ?, 0)", (code_upper, data.type, data.val, data.max_uses))
+        return {"status": "success"}
+    return db_write("economy", op)
+
+@app.post("/api/admin/backup/create")
+def admin_backup_create(data: AdminAuth):
+    if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
+    try:
+        name = make_snapshot()
+    except Exception as e:
+        return {"status": "error", "detail": str(e)}
+    return {"status": "success", "name": name}
+
+@app.post("/api/admin/backup/list")
+def admin_backup_list(data: AdminAuth):
+    if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
+    return {"status": "success", "snapshots": list_snapshots()}
+
+@app.post("/api/admin/backup/verify")
+def admin_backup_verify(data: AdminSnapshot):
+    if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
+    if data.name not in list_snapshots(): return {"status": "error", "detail": "Снапшот не найден"}
+    checks = verify_snapshot(data.name)
+    return {"status": "success", "ok": all(checks.values()), "files": checks}
+
+@app.post("/api/admin/backup/restore")
+def admin_backup_restore(data: AdminSnapshot):
+    if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
+    try:
+        restore_snapshot(data.name)
+    except Exception as e:
+        return {"status": "error", "detail": str(e)}
     return {"status": "success"}
 
-@app.post("/api/promo/activate")
+@app.post("/api/admin/admission")
+def admin_admission_stats(data: AdminAuth):
+    if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
+    with admission_lock:
+        routes = {route: {**admission_stats[route], "waiting": route_waiting[route]} for route in ADMISSION_LIMITS}
+        return {"status": "success", "routes": routes, "tracked_users": len(token_buckets)}
+
+@app.post("/api/admin/bitset/register")
+def admin_bitset_register(data: AdminBitKeys):
+    """Каталог ID наград/титулов, которым положен бит помимо целых 0..BITSET_MAX_ID-1"""
+    if data.password != ADMIN_PASSWORD: return {"status": "error", "detail": "Неверный пароль!"}
+    if data.kind not in BITSET_FIELDS.values(): return {"status": "error", "detail": "Неизвестный вид"}
+    bits = db_write("profile", lambda c: bit_indexes(c, data.kind, data.keys, register=True))
+    return {"status": "success", "bits": dict(zip(map(str, data.keys), bits))}
+
+@app.post("/api/promo/activate", dependencies=[admission("promo")])
 def activate_promo(data: PromoRequest):
-    conn = get_db()
-    c = conn.cursor()
-    code_upper = data.code.upper()
-    c.execute("SELECT * FROM user_promos WHERE user_id=? AND code=?", (data.user_id, code_upper))
-    if c.fetchone():
-        conn.close()
-        return {"status": "error", "detail": "Уже активирован!"}
-    c.execute("SELECT * FROM promo_codes WHERE code=?", (code_upper,))
-    promo = c.fetchone()
-    if not promo:
-        conn.close()
-        return {"status": "error", "detail": "Код не найден"}
-    if promo["max_uses"] > 0 and promo["uses"] >= promo["max_uses"]:
-        conn.close()
-        return {"status": "error", "detail": "Лимит активаций исчерпан!"}
-    c.execute("UPDATE promo_codes SET uses = uses + 1 WHERE code=?", (code_upper,))
-    c.execute("INSERT INTO user_promos (user_id, code) VALUES (?, ?)", (data.user_id, code_upper))
-    conn.commit()
-    conn.close()
-    return {"status": "success", "type": promo["type"], "val": promo["val"]}
+    def op(c):
+        code_upper = data.code.upper()
+        c.execute("SELECT * FROM user_promos WHERE user_id=? AND code=?", (data.user_id, code_upper))
+        if c.fetchone():
+            return {"status": "error", "detail": "Уже активирован!"}
+        c.execute("SELECT * FROM promo_codes WHERE code=?", (code_upper,))
+        promo = c.fetchone()
+        if not promo:
+            return {"status": "error", "detail": "Код не найден"}
+        if promo["max_uses"] > 0 and promo["uses"] >= promo["max_uses"]:
+            return {"status": "error", "detail": "Лимит активаций исчерпан!"}
+        c.execute("UPDATE promo_codes SET uses = uses + 1 WHERE code=?", (code_upper,))
+        c.execute("INSERT INTO user_promos (user_id, code) VALUES (?, ?)", (data.user_id, code_upper))
+        return {"status": "success", "type": promo["type"], "val": promo["val"]}
+    return db_write("economy", op)
 
 @app.post("/api/payment/invoice")
 def create_invoice(data: InvoiceData):
@@ -554,49 +1272,39 @@ def create_invoice(data: InvoiceData):
 @app.post("/api/party/create")
 @app.post("/api/api/party/create")
 def create_party(data: PlayerData):
-    conn = get_db()
-    c = conn.cursor()
-    code = str(random.randint(1000, 9999))
-    c.execute("INSERT INTO parties (code, boss_hp, boss_max_hp, mega_progress, mega_target, expedition_end, expedition_score, leader_id, active_game, expedition_location, wolf_hp, wolf_max_hp, mega_radar) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", 
-              (code, 10000, 10000, 0, 36000, 0, 0, data.user_id, 'none', 'forest', 0, 0, 0))
-    c.execute("DELETE FROM players WHERE user_id=?", (data.user_id,))
-    c.execute("INSERT INTO players (user_id, party_code, name, avatar, boss_hp, egg_skin, equipped_title) VALUES (?, ?, ?, ?, ?, ?, ?)", 
-              (data.user_id, code, data.name, data.avatar, 0, data.egg_skin, data.equipped_title))
-    conn.commit()
-    conn.close()
-    return {"status": "success", "partyCode": code}
+    def op(c):
+        code = str(random.randint(1000, 9999))
+        c.execute("INSERT INTO parties (code, boss_hp, boss_max_hp, mega_progress, mega_target, expedition_end, expedition_score, leader_id, active_game, expedition_location, wolf_hp, wolf_max_hp, mega_radar) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", 
+                  (code, 10000, 10000, 0, 36000, 0, 0, data.user_id, 'none', 'forest', 0, 0, 0))
+        c.execute("DELETE FROM players WHERE user_id=?", (data.user_id,))
+        c.execute("INSERT INTO players (user_id, party_code, name, avatar, boss_hp, egg_skin, equipped_title) VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                  (data.user_id, code, data.name, data.avatar, 0, data.egg_skin, data.equipped_title))
+        return {"status": "success", "partyCode": code}
+    return db_write("party", op)
 
 @app.post("/api/party/join")
 @app.post("/api/api/party/join")
 def join_party(data: JoinData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM parties WHERE code=?", (data.code,))
-    if not c.fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="Пати не найдено")
-    c.execute("DELETE FROM players WHERE user_id=?", (data.user_id,))
-    c.execute("INSERT INTO players (user_id, party_code, name, avatar, boss_hp, egg_skin, equipped_title) VALUES (?, ?, ?, ?, ?, ?, ?)", 
-              (data.user_id, data.code, data.name, data.avatar, 0, data.egg_skin, data.equipped_title))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("SELECT * FROM parties WHERE code=?", (data.code,))
+        if not c.fetchone():
+            raise HTTPException(status_code=404, detail="Пати не найдено")
+        c.execute("DELETE FROM players WHERE user_id=?", (data.user_id,))
+        c.execute("INSERT INTO players (user_id, party_code, name, avatar, boss_hp, egg_skin, equipped_title) VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                  (data.user_id, data.code, data.name, data.avatar, 0, data.egg_skin, data.equipped_title))
+        return {"status": "success"}
+    return db_write("party", op)
 
 @app.get("/api/party/status/{code}")
 @app.get("/api/api/party/status/{code}")
 def get_party_status(code: str):
-    conn = get_db()
+    conn = get_db("party", readonly=True)
     c = conn.cursor()
     c.execute("SELECT * FROM parties WHERE code=?", (code,))
     party = c.fetchone()
     if not party:
         conn.close()
         raise HTTPException(status_code=404, detail="Пати не найдено")
-    w_hp = party["wolf_hp"]
-    if party["expedition_end"] == 0 and w_hp > 0:
-        c.execute("UPDATE parties SET wolf_hp=0 WHERE code=?", (code,))
-        conn.commit()
-        w_hp = 0
     c.execute("SELECT user_id, name, avatar, boss_hp, egg_skin, equipped_title FROM players WHERE party_code=?", (code,))
     players = [dict(row) for row in c.fetchall()]
     conn.close()
@@ -604,7 +1312,8 @@ def get_party_status(code: str):
         "boss_hp": party["boss_hp"], "boss_max_hp": party["boss_max_hp"],
         "mega_progress": party["mega_progress"], "mega_target": party["mega_target"],
         "expedition_end": party["expedition_end"], "expedition_score": party["expedition_score"],
-        "expedition_location": party["expedition_location"], "wolf_hp": w_hp, "wolf_max_hp": party["wolf_max_hp"],
+        "expedition_location": party["expedition_location"], "wolf_hp": party["wolf_hp"], "wolf_max_hp": party["wolf_max_hp"],
+        "expedition_result": json.loads(party["expedition_result"]) if party["expedition_result"] else None,
         "mega_radar": party["mega_radar"], "leader_id": party["leader_id"], "active_game": party["active_game"],
         "players": players, "server_time": int(time.time())
     }
@@ -612,22 +1321,37 @@ def get_party_status(code: str):
 @app.post("/api/party/set_game")
 @app.post("/api/api/party/set_game")
 async def set_game(data: SetGameData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT leader_id FROM parties WHERE code=?", (data.code,))
-    party = c.fetchone()
-    if party and party["leader_id"] == data.user_id:
+    def op(c):
+        c.execute("SELECT leader_id FROM parties WHERE code=?", (data.code,))
+        party = c.fetchone()
+        if not party or party["leader_id"] != data.user_id:
+            return False
         c.execute("UPDATE parties SET active_game=? WHERE code=?", (data.game_name, data.code))
-        
         if data.game_name == 'none':
-            c.execute("UPDATE parties SET expedition_end=0, expedition_score=0, wolf_hp=0, mega_radar=0 WHERE code=?", (data.code,))
+            c.execute('''UPDATE parties SET expedition_end=0, expedition_score=0, wolf_hp=0, mega_radar=0,
+                         expedition_settled=0, expedition_result=NULL WHERE code=?''', (data.code,))
             c.execute("UPDATE players SET boss_hp=0 WHERE party_code=?", (data.code,))
+        elif data.game_name == 'tap_boss':
+            c.execute("UPDATE parties SET boss_hp=10000, boss_max_hp=10000 WHERE code=?", (data.code,))
+            c.execute("UPDATE players SET boss_hp=0 WHERE party_code=?", (data.code,))
+        return True
+
+    # Состояние игр в памяти меняем уже после записи в БД, в потоке event loop
+    if await db_write_async("party", op):
+        if data.game_name == 'none':
             if data.code in active_reactors:
                 del active_reactors[data.code]
+            active_boss_fights.pop(data.code, None)
                 
         elif data.game_name == 'tap_boss':
-            c.execute("UPDATE parties SET boss_hp=10000, boss_max_hp=10000 WHERE code=?", (data.code,))
-            c.execute("UPDATE players SET boss_hp=0 WHERE party_code=?", (data.code,))
+            if HAS_SOCKETIO:
+                # members — игроки пати по данным последнего тика (None, пока тика не было)
+                fresh = {'pending': {}, 'tap_budget': {}, 'sid_users': {}, 'members': None, 'last_tap': time.monotonic()}
+                if data.code in active_boss_fights:
+                    active_boss_fights[data.code].update(fresh)   # тик уже идёт — он владеет этим боем
+                else:
+                    active_boss_fights[data.code] = fresh
+                    asyncio.create_task(boss_tick_task(data.code))
             
         elif data.game_name == 'quantum_reactor':
             if HAS_SOCKETIO:
@@ -637,172 +1361,266 @@ async def set_game(data: SetGameData):
                     'secretCode': random.choices(GENES, k=4)
                 }
                 asyncio.create_task(reactor_timer_task(data.code))
-            
-        conn.commit()
-    conn.close()
     return {"status": "success"}
 
-@app.post("/api/party/damage")
-@app.post("/api/api/party/damage")
+@app.post("/api/party/damage", dependencies=[admission("damage")])
+@app.post("/api/api/party/damage", dependencies=[admission("damage")])
 def deal_damage(data: DamageData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT boss_hp FROM parties WHERE code=?", (data.code,))
-    party = c.fetchone()
-    if not party or party["boss_hp"] <= 0:
-        conn.close()
-        return {"status": "error"}
-    new_boss_hp = max(0, party["boss_hp"] - data.damage)
-    c.execute("UPDATE parties SET boss_hp=? WHERE code=?", (new_boss_hp, data.code))
-    c.execute("UPDATE players SET boss_hp = boss_hp + ? WHERE user_id=? AND party_code=?", (data.damage, data.user_id, data.code))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
-
-@app.post("/api/party/expedition/wolf_damage")
-@app.post("/api/api/party/expedition/wolf_damage")
+    def op(c):
+        c.execute("SELECT boss_hp FROM parties WHERE code=?", (data.code,))
+        party = c.fetchone()
+        if not party or party["boss_hp"] <= 0:
+            return {"status": "error"}
+        new_boss_hp = max(0, party["boss_hp"] - data.damage)
+        c.execute("UPDATE parties SET boss_hp=? WHERE code=?", (new_boss_hp, data.code))
+        c.execute("UPDATE players SET boss_hp = boss_hp + ? WHERE user_id=? AND party_code=?", (data.damage, data.user_id, data.code))
+        return {"status": "success"}
+    return db_write("party", op)
+
+def boss_damage_op(code, damage_by_user):
+    """op для писателя party: списывает накопленный урон одной транзакцией.
+    Возвращает состояние боя или None, если пати нет"""
+    def op(c):
+        c.execute("SELECT boss_hp, boss_max_hp FROM parties WHERE code=?", (code,))
+        party = c.fetchone()
+        if not party:
+            return None
+        # Урон засчитывается только игрокам, которые реально в пати
+        c.execute("SELECT user_id FROM players WHERE party_code=?", (code,))
+        members = {row["user_id"] for row in c.fetchall()}
+        damage = {user_id: dmg for user_id, dmg in damage_by_user.items() if user_id in members}
+        boss_hp = party["boss_hp"]
+        if boss_hp > 0 and damage:
+            boss_hp = max(0, boss_hp - sum(damage.values()))
+            c.execute("UPDATE parties SET boss_hp=? WHERE code=?", (boss_hp, code))
+            c.executemany("UPDATE players SET boss_hp = boss_hp + ? WHERE user_id=? AND party_code=?",
+                          [(dmg, user_id, code) for user_id, dmg in damage.items()])
+        c.execute("SELECT user_id, boss_hp FROM players WHERE party_code=?", (code,))
+        players = {row["user_id"]: row["boss_hp"] for row in c.fetchall()}
+        return {"boss_hp": boss_hp, "boss_max_hp": party["boss_max_hp"], "players": players}
+    return op
+
+@app.post("/api/party/expedition/wolf_damage", dependencies=[admission("damage")])
+@app.post("/api/api/party/expedition/wolf_damage", dependencies=[admission("damage")])
 def wolf_damage(data: DamageData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT wolf_hp FROM parties WHERE code=?", (data.code,))
-    party = c.fetchone()
-    if party and party["wolf_hp"] > 0:
-        new_hp = max(0, party["wolf_hp"] - data.damage)
-        c.execute("UPDATE parties SET wolf_hp=? WHERE code=?", (new_hp, data.code))
-        conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("SELECT wolf_hp FROM parties WHERE code=?", (data.code,))
+        party = c.fetchone()
+        if party and party["wolf_hp"] > 0:
+            new_hp = max(0, party["wolf_hp"] - data.damage)
+            c.execute("UPDATE parties SET wolf_hp=? WHERE code=?", (new_hp, data.code))
+        return {"status": "success"}
+    return db_write("party", op)
 
 @app.post("/api/party/mega_egg/add")
 def add_mega_egg_time(data: TimeData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT mega_progress, mega_target FROM parties WHERE code=?", (data.code,))
-    party = c.fetchone()
-    if party:
-        new_progress = min(party["mega_target"], party["mega_progress"] + data.seconds)
-        c.execute("UPDATE parties SET mega_progress=? WHERE code=?", (new_progress, data.code))
-        conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("SELECT mega_progress, mega_target FROM parties WHERE code=?", (data.code,))
+        party = c.fetchone()
+        if party:
+            new_progress = min(party["mega_target"], party["mega_progress"] + data.seconds)
+            c.execute("UPDATE parties SET mega_progress=? WHERE code=?", (new_progress, data.code))
+        return {"status": "success"}
+    return db_write("party", op)
 
 @app.post("/api/party/mega_egg/claim")
 def claim_mega_egg(data: CodeOnly):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("UPDATE parties SET mega_progress=0 WHERE code=?", (data.code,))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("UPDATE parties SET mega_progress=0 WHERE code=?", (data.code,))
+        return {"status": "success"}
+    return db_write("party", op)
 
 @app.post("/api/party/radar")
 def activate_radar(data: CodeOnly):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("UPDATE parties SET mega_radar=1 WHERE code=?", (data.code,))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("UPDATE parties SET mega_radar=1 WHERE code=?", (data.code,))
+        return {"status": "success"}
+    return db_write("party", op)
+
+# Итог экспедиции фиксируется один раз, когда вышло время: очки, локация и чем кончился волк.
+# Волк при этом сбрасывается — GET-статус больше ничего не пишет
+SETTLE_SQL = '''UPDATE parties SET wolf_hp=0, expedition_settled=1,
+                expedition_result=json_object('score', expedition_score, 'location', expedition_location, 'ended_at', expedition_end,
+                    'wolf', CASE WHEN wolf_max_hp = 0 THEN NULL WHEN wolf_hp = 0 THEN 'defeated' ELSE 'escaped' END)
+                WHERE expedition_settled=0 AND expedition_end > 0 AND expedition_end <= ?'''
+SETTLE_INTERVAL = float(os.getenv("SETTLE_INTERVAL", "5"))   # сек между проходами
+
+def settle_expeditions(c, now=None):
+    """Закрывает ВСЕ истёкшие экспедиции одним UPDATE (по частичному индексу idx_parties_unsettled)"""
+    c.execute(SETTLE_SQL, (int(time.time()) if now is None else now,))
+    return c.rowcount
+
+async def expedition_settler_task():
+    while True:
+        await asyncio.sleep(SETTLE_INTERVAL)
+        try:
+            await db_write_async("party", settle_expeditions)
+        except Exception as e:
+            print(f"[settle] ошибка расчёта экспедиций: {e}")
+
+@app.on_event("startup")
+async def start_expedition_settler():
+    if SETTLE_INTERVAL > 0:
+        asyncio.create_task(expedition_settler_task())
 
 @app.post("/api/party/expedition/start")
 def start_expedition(data: ExpeditionStartData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT avatar FROM players WHERE party_code=?", (data.code,))
-    players = c.fetchall()
-    score = 0; farm_count = 0; pred_count = 0
-    for p in players:
-        av = p["avatar"]
-        if av in ["unicorn", "dragon", "alien", "robot", "dino", "fireball", "god"]: score += 10
-        elif av in ["fox", "panda", "tiger", "lion", "cow", "pig", "monkey", "owl"]: score += 3
-        else: score += 1
-        if av in ["cow", "pig", "duck"]: farm_count += 1
-        if av in ["kitten", "tiger", "lion", "fox"]: pred_count += 1
-
-    if farm_count >= 3: score = int(score * 1.5)
-    base_time = 5 * 60
-    if data.location == 'mountains': base_time = 15 * 60
-    elif data.location == 'space': base_time = 25 * 60
-    if pred_count >= 2: base_time = int(base_time * 0.85)
-
-    end_time = int(time.time()) + base_time
-    wolf_hp = 0
-    if random.random() < 0.15: wolf_hp = len(players) * 20 
+    def op(c):
+        c.execute("SELECT avatar FROM players WHERE party_code=?", (data.code,))
+        players = c.fetchall()
+        score = 0; farm_count = 0; pred_count = 0
+        for p in players:
+            points, farm, predator = AVATAR_TRAITS.get(p["avatar"], DEFAULT_TRAITS)
+            score += points; farm_count += farm; pred_count += predator
+
+        if farm_count >= 3: score = int(score * 1.5)
+        base_time = EXPEDITION_TIME.get(data.location, EXPEDITION_TIME["forest"])
+        if pred_count >= 2: base_time = int(base_time * 0.85)
+
+        end_time = int(time.time()) + base_time
+        wolf_hp = 0
+        if random.random() < 0.15: wolf_hp = len(players) * 20 
     
-    c.execute("UPDATE parties SET expedition_end=?, expedition_score=?, expedition_location=?, wolf_hp=?, wolf_max_hp=? WHERE code=?", 
-              (end_time, score, data.location, wolf_hp, wolf_hp, data.code))
-    conn.commit()
-    conn.close()
-    return {"status": "success", "end_time": end_time}
+        c.execute('''UPDATE parties SET expedition_end=?, expedition_score=?, expedition_location=?, wolf_hp=?, wolf_max_hp=?,
+                     expedition_settled=0, expedition_result=NULL WHERE code=?''', 
+                  (end_time, score, data.location, wolf_hp, wolf_hp, data.code))
+        return {"status": "success", "end_time": end_time}
+    return db_write("party", op)
 
 @app.post("/api/party/expedition/claim")
 def claim_expedition(data: CodeOnly):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("UPDATE parties SET expedition_end=0, expedition_score=0, wolf_hp=0, mega_radar=0 WHERE code=?", (data.code,))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        # Фоновый проход мог ещё не дойти до этой пати — досчитываем её сами
+        c.execute(SETTLE_SQL + " AND code=?", (int(time.time()), data.code))
+        c.execute("SELECT expedition_result FROM parties WHERE code=?", (data.code,))
+        row = c.fetchone()
+        c.execute('''UPDATE parties SET expedition_end=0, expedition_score=0, wolf_hp=0, mega_radar=0,
+                     expedition_settled=0, expedition_result=NULL WHERE code=?''', (data.code,))
+        return {"status": "success", "result": json.loads(row["expedition_result"]) if row and row["expedition_result"] else None}
+    return db_write("party", op)
 
 @app.post("/api/party/leave")
 @app.post("/api/api/party/leave")
 def leave_party(data: PlayerData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT code, leader_id FROM parties WHERE code=(SELECT party_code FROM players WHERE user_id=?)", (data.user_id,))
-    party = c.fetchone()
-    if party and party["leader_id"] == data.user_id:
-        party_code = party["code"]
-        c.execute("DELETE FROM players WHERE party_code=?", (party_code,))
-        c.execute("DELETE FROM parties WHERE code=?", (party_code,))
-    else:
-        c.execute("DELETE FROM players WHERE user_id=?", (data.user_id,))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("SELECT code, leader_id FROM parties WHERE code=(SELECT party_code FROM players WHERE user_id=?)", (data.user_id,))
+        party = c.fetchone()
+        if party and party["leader_id"] == data.user_id:
+            party_code = party["code"]
+            c.execute("DELETE FROM players WHERE party_code=?", (party_code,))
+            c.execute("DELETE FROM parties WHERE code=?", (party_code,))
+        else:
+            c.execute("DELETE FROM players WHERE user_id=?", (data.user_id,))
+        return {"status": "success"}
+    return db_write("party", op)
 
-@app.post("/api/users/sync")
-@app.post("/api/api/users/sync")
+@app.post("/api/users/sync", dependencies=[admission("profile")])
+@app.post("/api/api/users/sync", dependencies=[admission("profile")])
 def sync_global_user(data: GlobalUserSync):
-    conn = get_db()
+    def op(c):
+        # Награды и титулы кладём битсетами; не-JSON строку (старый клиент) — как есть
+        rewards_bits = json_to_bits(c, "reward", data.claimed_rewards)
+        titles_bits = json_to_bits(c, "title", data.unlocked_titles)
+        rewards_text = None if rewards_bits is not None else data.claimed_rewards
+        titles_text = None if titles_bits is not None else data.unlocked_titles
+        # В поиске переиндексируем только новое или сменившееся имя — синк шлётся часто
+        c.execute("SELECT name FROM global_users WHERE user_id=?", (data.user_id,))
+        old = c.fetchone()
+        renamed = old is None or old['name'] != data.name
+        if old is not None and renamed:
+            search_unindex(c, "global_users", data.user_id)
+        c.execute('''INSERT INTO global_users (user_id, name, avatar, level, earned, hatched, dust, claimed_rewards, claimed_rewards_bits, mythic_tickets, active_theme, showcase, focus_hours, mythics_crafted, reactor_wins, equipped_title, unlocked_titles, unlocked_titles_bits) 
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) 
+                     ON CONFLICT(user_id) DO UPDATE SET 
+                     name=excluded.name, avatar=excluded.avatar, level=excluded.level, 
+                     earned=excluded.earned, hatched=excluded.hatched, dust=excluded.dust,
+                     claimed_rewards=excluded.claimed_rewards, claimed_rewards_bits=excluded.claimed_rewards_bits,
+                     mythic_tickets=excluded.mythic_tickets,
+                     active_theme=excluded.active_theme, showcase=excluded.showcase,
+                     focus_hours=excluded.focus_hours, mythics_crafted=excluded.mythics_crafted,
+                     reactor_wins=excluded.reactor_wins, equipped_title=excluded.equipped_title,
+                     unlocked_titles=excluded.unlocked_titles, unlocked_titles_bits=excluded.unlocked_titles_bits''', 
+                  (data.user_id, data.name, data.avatar, data.level, data.earned, data.hatched, data.dust, rewards_text, rewards_bits, data.mythic_tickets, data.active_theme, data.showcase, data.focus_hours, data.mythics_crafted, data.reactor_wins, data.equipped_title, titles_text, titles_bits))
+        if renamed:
+            search_index(c, "global_users", data.user_id)
+        return {"status": "success"}
+    return db_write("profile", op)
+
+def add_bitset_item(user_id, field, item, unique_error=None):
+    """Добавляет ID в битсет игрока (или в JSON-текст, если бит ему не положен). unique_error — текст ошибки, если ID уже был"""
+    kind = BITSET_FIELDS[field]
+    def op(c):
+        c.execute(f"SELECT {field}, {field}_bits FROM global_users WHERE user_id=?", (user_id,))
+        row = c.fetchone()
+        if not row:
+            return {"status": "error", "detail": "Игрок не найден"}
+        if row[1] is not None:
+            items = json.loads(bits_to_json(c, kind, row[1]))
+        else:
+            try: items = json.loads(row[0] or "[]")
+            except ValueError: items = None
+            if not isinstance(items, list):
+                return {"status": "error", "detail": "Повреждённые данные профиля"}
+        if item in items:
+            if unique_error:
+                return {"status": "error", "detail": unique_error}
+        else:
+            items.append(item)
+        text = json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+        bits = json_to_bits(c, kind, text)
+        c.execute(f"UPDATE global_users SET {field}=?, {field}_bits=? WHERE user_id=?",
+                  (text if bits is None else None, bits, user_id))
+        return {"status": "success", field: text if bits is None else bits_to_json(c, kind, bits)}
+    return db_write("profile", op)
+
+@app.post("/api/users/rewards/claim")
+@app.post("/api/api/users/rewards/claim")
+def claim_reward(data: RewardClaim):
+    return add_bitset_item(data.user_id, "claimed_rewards", data.reward_id, unique_error="Награда уже получена")
+
+@app.post("/api/users/titles/unlock")
+@app.post("/api/api/users/titles/unlock")
+def unlock_title(data: TitleUnlock):
+    return add_bitset_item(data.user_id, "unlocked_titles", data.title_id)
+
+@app.get("/api/users/progress/{user_id}")
+@app.get("/api/api/users/progress/{user_id}")
+def get_user_progress(user_id: str):
+    conn = get_db("profile", readonly=True)
     c = conn.cursor()
-    c.execute('''INSERT INTO global_users (user_id, name, avatar, level, earned, hatched, dust, claimed_rewards, mythic_tickets, active_theme, showcase, focus_hours, mythics_crafted, reactor_wins, equipped_title, unlocked_titles) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) 
-                 ON CONFLICT(user_id) DO UPDATE SET 
-                 name=excluded.name, avatar=excluded.avatar, level=excluded.level, 
-                 earned=excluded.earned, hatched=excluded.hatched, dust=excluded.dust,
-                 claimed_rewards=excluded.claimed_rewards, mythic_tickets=excluded.mythic_tickets,
-                 active_theme=excluded.active_theme, showcase=excluded.showcase,
-                 focus_hours=excluded.focus_hours, mythics_crafted=excluded.mythics_crafted,
-                 reactor_wins=excluded.reactor_wins, equipped_title=excluded.equipped_title,
-                 unlocked_titles=excluded.unlocked_titles''', 
-              (data.user_id, data.name, data.avatar, data.level, data.earned, data.hatched, data.dust, data.claimed_rewards, data.mythic_tickets, data.active_theme, data.showcase, data.focus_hours, data.mythics_crafted, data.reactor_wins, data.equipped_title, data.unlocked_titles))
-    conn.commit()
+    c.execute("SELECT claimed_rewards, claimed_rewards_bits, unlocked_titles, unlocked_titles_bits FROM global_users WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    if not row:
+        conn.close()
+        return {"status": "error", "detail": "Игрок не найден"}
+    progress = {field: row[field] if row[f"{field}_bits"] is None else bits_to_json(c, kind, row[f"{field}_bits"])
+                for field, kind in BITSET_FIELDS.items()}
     conn.close()
-    return {"status": "success"}
+    return {"status": "success", **progress}
 
 @app.post("/api/friends/add")
 @app.post("/api/api/friends/add")
 def add_friend(data: FriendAction):
     if data.user_id == data.friend_id: return {"status": "error", "detail": "Нельзя добавить себя"}
-    conn = get_db()
+    conn = get_db("profile", readonly=True)
     c = conn.cursor()
     c.execute("SELECT * FROM global_users WHERE user_id=?", (data.friend_id,))
-    if not c.fetchone(): 
-        conn.close()
+    found = c.fetchone()
+    conn.close()
+    if not found: 
         return {"status": "error", "detail": "Игрок не найден"}
-    try:
+    def op(c):
         c.execute("INSERT INTO friends (user_id, friend_id) VALUES (?, ?)", (data.user_id, data.friend_id))
         c.execute("INSERT INTO friends (user_id, friend_id) VALUES (?, ?)", (data.friend_id, data.user_id))
-        conn.commit()
+    try:
+        db_write("social", op)
     except sqlite3.IntegrityError: pass 
-    conn.close()
     return {"status": "success"}
 
 @app.get("/api/friends/list/{user_id}")
 @app.get("/api/api/friends/list/{user_id}")
 def get_friends_list(user_id: str):
-    conn = get_db()
+    conn = get_db("social", attach=("profile",), readonly=True)
     c = conn.cursor()
     c.execute('''SELECT g.user_id, g.name, g.avatar, g.level, g.equipped_title, s.tag as syndicate_tag 
                  FROM friends f JOIN global_users g ON f.friend_id = g.user_id 
@@ -814,19 +1632,17 @@ def get_friends_list(user_id: str):
 @app.post("/api/invites/send")
 @app.post("/api/api/invites/send")
 def send_invite(data: InviteData):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("DELETE FROM party_invites WHERE sender_id=? AND receiver_id=?", (data.sender_id, data.receiver_id))
-    c.execute("INSERT INTO party_invites (sender_id, receiver_id, party_code, timestamp) VALUES (?, ?, ?, ?)", 
-              (data.sender_id, data.receiver_id, data.party_code, int(time.time())))
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("DELETE FROM party_invites WHERE sender_id=? AND receiver_id=?", (data.sender_id, data.receiver_id))
+        c.execute("INSERT INTO party_invites (sender_id, receiver_id, party_code, timestamp) VALUES (?, ?, ?, ?)", 
+                  (data.sender_id, data.receiver_id, data.party_code, int(time.time())))
+        return {"status": "success"}
+    return db_write("social", op)
 
 @app.get("/api/invites/check/{user_id}")
 @app.get("/api/api/invites/check/{user_id}")
 def check_invites(user_id: str):
-    conn = get_db()
+    conn = get_db("social", attach=("profile",), readonly=True)
     c = conn.cursor()
     c.execute('''SELECT i.id, i.party_code, g.name as sender_name, g.avatar as sender_avatar 
                  FROM party_invites i JOIN global_users g ON i.sender_id = g.user_id
@@ -839,12 +1655,10 @@ def check_invites(user_id: str):
 @app.post("/api/invites/clear")
 @app.post("/api/api/invites/clear")
 def clear_invite(data: CodeOnly):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("DELETE FROM party_invites WHERE id=?", (data.code,)) 
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
+    def op(c):
+        c.execute("DELETE FROM party_invites WHERE id=?", (data.code,)) 
+        return {"status": "success"}
+    return db_write("social", op)
 
 # ==========================================
 # ИНТЕГРАЦИЯ WEBSOCKETS И FASTAPI
@@ -880,4 +1694,62 @@ if HAS_SOCKETIO:
             reactor['timeLeft'] -= 5
             await sio.emit('wrongCode', {'newTimeLeft': reactor['timeLeft']}, room=room_id)
 
-    app = socketio.ASGIApp(sio, other_asgi_app=app)
\ No newline at end of file
+    @sio.on('tapBoss')
+    async def handle_tap_boss(sid, data):
+        """Пачка тапов: {roomId, userId, taps, damage}. Урон уходит в БД на ближайшем тике"""
+        room_id = data.get('roomId')
+        user_id = data.get('userId')
+        fight = active_boss_fights.get(room_id)
+        if not fight or not user_id: return
+        if fight['members'] is not None and user_id not in fight['members']: return
+        # Сокет бьёт за одного игрока: первый userId закрепляется за sid до конца боя
+        if fight['sid_users'].setdefault(sid, user_id) != user_id: return
+
+        try:
+            taps = max(0, int(data.get('taps', 0)))
+            damage = max(0, int(data.get('damage', taps)))
+        except (TypeError, ValueError):
+            return
+
+        # Не больше, чем реально можно натапать: запас копится со скоростью TAP_MAX_RATE, максимум на 2 сек.
+        # Бакет на игрока, а не на сокет — лишние вкладки не умножают лимит
+        now = time.monotonic()
+        budget, last = fight['tap_budget'].get(user_id, (TAP_MAX_RATE, now))
+        budget = min(TAP_MAX_RATE * 2, budget + (now - last) * TAP_MAX_RATE)
+        taps = min(taps, int(budget))
+        fight['tap_budget'][user_id] = (budget - taps, now)
+        damage = min(damage, taps * TAP_MAX_DAMAGE)
+        if damage:
+            fight['pending'][user_id] = fight['pending'].get(user_id, 0) + damage
+            fight['last_tap'] = now
+
+    @sio.on('disconnect')
+    async def handle_disconnect(sid, *args):
+        # бакет игрока остаётся: переподключение не должно обнулять лимит (чистит тик по составу пати)
+        for fight in active_boss_fights.values():
+            fight['sid_users'].pop(sid, None)
+
+    app = socketio.ASGIApp(sio, other_asgi_app=app)
+
+# Ручное управление бэкапами, когда сервер остановлен:
+#   python main.py backup | list | verify <name> | restore <name>
+# Перестройка поискового индекса (после VACUUM profile-шарда):
+#   python main.py reindex
+# Проверка планов запросов и допуска — в tests/ (python -m pytest tests)
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "backup":
+        print(make_snapshot())
+    elif cmd == "list":
+        print("\n".join(list_snapshots()))
+    elif cmd == "verify" and len(sys.argv) > 2:
+        print(verify_snapshot(sys.argv[2]))
+    elif cmd == "restore" and len(sys.argv) > 2:
+        restore_snapshot(sys.argv[2])
+        print("restored", sys.argv[2])
+    elif cmd == "reindex":
+        conn = get_db("profile")
+        rebuild_search_indexes(conn)
+        conn.close()
+    else:
+        print("usage: python main.py backup | list | verify <name> | restore <name> | reindex")
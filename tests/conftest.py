@@ -0,0 +1,25 @@
+# Общие фикстуры тестов. main.py при импорте создаёт базы в DB_DIR, поэтому окружение
+# выставляется ДО импорта: по умолчанию — временная папка, без фоновых задач.
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ.setdefault("DB_DIR", tempfile.mkdtemp(prefix="focus-tests-"))
+os.environ.setdefault("BACKUP_INTERVAL", "0")
+os.environ.setdefault("SETTLE_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as app_main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def main():
+    return app_main
+
+
+@pytest.fixture(scope="session")
+def fastapi_app(main):
+    # с python-socketio main.app — это ASGI-обёртка, сами роуты живут в other_asgi_app
+    return getattr(main.app, "other_asgi_app", main.app)
@@ -0,0 +1,114 @@
+# Допуск запросов: токен-бакеты на игрока (429) и сброс нагрузки по классу роута (503).
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+LOAD_SECONDS = 2.0
+NORMAL_USERS = 4
+NORMAL_RATE = 5          # запросов/сек у честного игрока — в 4 раза ниже лимита damage
+ABUSER_THREADS = 4
+NORMAL_P99_MS = 250
+
+
+def test_take_token_burst_then_refill(main):
+    rate, burst = 2, 3
+    assert [main.take_token("t-unit", "u", rate, burst, 0.0) for _ in range(4)] == [True, True, True, False]
+    assert main.take_token("t-unit", "u", rate, burst, 0.25) is False   # накапало полтокена
+    assert main.take_token("t-unit", "u", rate, burst, 0.5) is True     # +1 за полсекунды (с учётом отказа выше)
+    assert main.take_token("t-unit", "u", rate, burst, 0.5) is False
+    # за долгий простой бакет наполняется только до burst
+    assert [main.take_token("t-unit", "u", rate, burst, 100.0) for _ in range(4)] == [True, True, True, False]
+    # у другого игрока свой бакет
+    assert main.take_token("t-unit", "other", rate, burst, 100.0) is True
+
+
+def test_idle_buckets_are_forgotten(main, monkeypatch):
+    now = main.last_bucket_sweep
+    main.take_token("t-idle", "gone", 1, 1, now)
+    later = now + main.ADMISSION_IDLE + 1
+    main.take_token("t-idle", "fresh", 1, 1, later)
+    assert ("t-idle", "gone") not in main.token_buckets
+    assert ("t-idle", "fresh") in main.token_buckets
+
+
+@pytest.fixture
+def client(main, fastapi_app, monkeypatch):
+    # семафоры привязываются к event loop первого ожидания — каждому клиенту свои
+    for route, limits in main.ADMISSION_LIMITS.items():
+        monkeypatch.setitem(main.route_slots, route, asyncio.Semaphore(limits[2]))
+    with TestClient(fastapi_app) as client:
+        yield client
+
+
+def damage_stats(main):
+    return dict(main.admission_stats["damage"])
+
+
+def test_abuser_is_rate_limited_while_normal_users_stay_fast(main, client):
+    code = client.post("/api/party/create", json={"user_id": "adm-leader", "name": "L", "avatar": "a",
+                                                  "egg_skin": "d"}).json()["partyCode"]
+    client.post("/api/party/set_game", json={"code": code, "user_id": "adm-leader", "game_name": "tap_boss"})
+    before = damage_stats(main)
+    abuser_codes = []
+    normal = {f"adm-normal-{i}": [] for i in range(NORMAL_USERS)}   # игрок -> [(статус, мс)]
+    stop = threading.Event()
+
+    def abuser():
+        while not stop.is_set():
+            r = client.post("/api/party/damage", json={"code": code, "user_id": "adm-abuser", "damage": 1})
+            abuser_codes.append(r.status_code)
+
+    def honest(user_id):
+        while not stop.is_set():
+            started = time.perf_counter()
+            r = client.post("/api/party/damage", json={"code": code, "user_id": user_id, "damage": 1})
+            elapsed = time.perf_counter() - started
+            normal[user_id].append((r.status_code, elapsed * 1000))
+            time.sleep(max(0.0, 1 / NORMAL_RATE - elapsed))
+
+    threads = [threading.Thread(target=abuser) for _ in range(ABUSER_THREADS)]
+    threads += [threading.Thread(target=honest, args=(user_id,)) for user_id in normal]
+    for t in threads:
+        t.start()
+    time.sleep(LOAD_SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    after = damage_stats(main)
+
+    # бюджет абьюзера: burst + rate * время, всё сверх — 429, и каждый 429 посчитан
+    rate, burst = main.ADMISSION_LIMITS["damage"][:2]
+    assert abuser_codes.count(200) <= burst + rate * (LOAD_SECONDS + 1)
+    assert abuser_codes.count(429) > abuser_codes.count(200)
+    assert after["rate_limited"] - before["rate_limited"] == abuser_codes.count(429)
+    assert after["shed"] - before["shed"] == abuser_codes.count(503)
+
+    statuses = [status for calls in normal.values() for status, _ in calls]
+    latencies = sorted(ms for calls in normal.values() for _, ms in calls)
+    assert statuses and set(statuses) == {200}
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    assert p99 < NORMAL_P99_MS, f"p99 честных игроков {p99:.0f} мс"
+
+
+def test_full_waiting_queue_is_shed(main, client, monkeypatch):
+    max_waiting = main.ADMISSION_LIMITS["damage"][3]
+    monkeypatch.setitem(main.route_waiting, "damage", max_waiting)
+    before = damage_stats(main)
+    r = client.post("/api/party/damage", json={"code": "x", "user_id": "adm-shed-queue", "damage": 1})
+    assert r.status_code == 503
+    assert damage_stats(main)["shed"] == before["shed"] + 1
+
+
+def test_no_free_slot_within_wait_is_shed(main, client, monkeypatch):
+    monkeypatch.setitem(main.route_slots, "damage", asyncio.Semaphore(0))
+    monkeypatch.setattr(main, "ADMISSION_WAIT", 0.05)
+    before = damage_stats(main)
+    r = client.post("/api/party/damage", json={"code": "x", "user_id": "adm-shed-wait", "damage": 1})
+    assert r.status_code == 503
+    after = damage_stats(main)
+    assert after["shed"] == before["shed"] + 1
+    assert after["admitted"] == before["admitted"]
+    assert main.route_waiting["damage"] == 0   # ждущий слот освободился
@@ -0,0 +1,24 @@
+# Снапшоты: ротация никогда не удаляет свежий снапшот и тот, из которого восстанавливаемся.
+import pytest
+
+
+@pytest.fixture
+def no_snapshots(main):
+    for name in main.list_snapshots():
+        main.shutil.rmtree(main.os.path.join(main.BACKUP_DIR, name))
+
+
+@pytest.mark.parametrize("keep", [0, 1])
+def test_rotation_keeps_the_newest_snapshot(main, no_snapshots, monkeypatch, keep):
+    monkeypatch.setattr(main, "BACKUP_KEEP", keep)
+    main.make_snapshot()
+    newest = main.make_snapshot()
+    assert main.list_snapshots() == [newest]
+
+
+def test_restore_keeps_target_and_safety_snapshot(main, no_snapshots, monkeypatch):
+    monkeypatch.setattr(main, "BACKUP_KEEP", 0)
+    target = main.make_snapshot()
+    main.restore_snapshot(target)
+    snapshots = main.list_snapshots()
+    assert target in snapshots and len(snapshots) == 2   # + свежий снапшот перед откатом
@@ -0,0 +1,57 @@
+# Битсеты наград и титулов: номера битов выдаются по bit_keys, наружу — тот же JSON-массив.
+import json
+
+
+def sync(main, user_id, rewards, level=1, earned=0):
+    return main.sync_global_user(main.GlobalUserSync(user_id=user_id, name=user_id, avatar="a", level=level,
+                                                     earned=earned, hatched=0, claimed_rewards=json.dumps(rewards)))
+
+
+def used_bits(main, kind):
+    conn = main.get_db("profile", readonly=True)
+    count = conn.execute("SELECT COUNT(*) FROM bit_keys WHERE kind=?", (kind,)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_junk_ids_cannot_allocate_shared_bits(main):
+    before = used_bits(main, "reward")
+    junk = [f"junk{i}" for i in range(30000)] + list(range(main.BITSET_MAX_ID + 5000)) + [-1, 2.5, True]
+    assert sync(main, "bits-evil", junk)["status"] == "success"
+    assert sync(main, "bits-evil", list(range(main.BITSET_MAX_ID)))["status"] == "success"   # все целые биты заняты
+    assert used_bits(main, "reward") <= before + main.BITSET_MAX_ID
+
+    # чужой синк с новыми ID не отклоняется: такие ID просто живут у игрока JSON-текстом
+    assert sync(main, "bits-honest", [1, 2, "season2-final"], level=7, earned=1234) == {"status": "success"}
+    conn = main.get_db("profile", readonly=True)
+    assert tuple(conn.execute("SELECT level, earned FROM global_users WHERE user_id='bits-honest'").fetchone()) == (7, 1234)
+    conn.close()
+    assert main.claim_reward(main.RewardClaim(user_id="bits-honest", reward_id="season3"))["status"] == "success"
+    assert main.get_user_progress("bits-honest")["claimed_rewards"] == '[1,2,"season2-final","season3"]'
+    assert main.claim_reward(main.RewardClaim(user_id="bits-honest", reward_id=2))["status"] == "error"
+
+
+def test_catalog_ids_and_small_ints_are_stored_as_bits(main):
+    assert sync(main, "bits-ok", [1, 2, 3]) == {"status": "success"}
+    assert main.admin_bitset_register(main.AdminBitKeys(password=main.ADMIN_PASSWORD, kind="title",
+                                                        keys=["bits-vip"]))["status"] == "success"
+    assert main.unlock_title(main.TitleUnlock(user_id="bits-ok", title_id="bits-vip"))["status"] == "success"
+    assert main.claim_reward(main.RewardClaim(user_id="bits-ok", reward_id=4))["status"] == "success"
+    conn = main.get_db("profile", readonly=True)
+    row = conn.execute("SELECT claimed_rewards, claimed_rewards_bits, unlocked_titles, unlocked_titles_bits "
+                       "FROM global_users WHERE user_id='bits-ok'").fetchone()
+    conn.close()
+    assert row[0] is None and row[1] is not None and row[2] is None and row[3] is not None
+    assert main.get_user_progress("bits-ok") == {"status": "success", "claimed_rewards": "[1,2,3,4]",
+                                                 "unlocked_titles": '["bits-vip"]'}
+
+
+def test_restore_forgets_cached_bits(main):
+    snapshot = main.make_snapshot()
+    sync(main, "bits-restore-a", ["after-snapshot"])   # бит выдан и закэширован, в снапшоте его нет
+    main.restore_snapshot(snapshot)
+
+    sync(main, "bits-restore-a", ["after-snapshot"])
+    sync(main, "bits-restore-b", ["other"])
+    assert main.get_user_progress("bits-restore-a")["claimed_rewards"] == '["after-snapshot"]'
+    assert main.get_user_progress("bits-restore-b")["claimed_rewards"] == '["other"]'
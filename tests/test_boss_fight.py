@@ -0,0 +1,145 @@
+# Тап-Босс через сокеты: лимит тапов на игрока, отсев чужих, запись урона тиком.
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.filterwarnings("ignore::DeprecationWarning")
+
+
+@pytest.fixture
+def boss(main, monkeypatch):
+    if not main.HAS_SOCKETIO:
+        pytest.skip("нужен python-socketio")
+    emitted = []
+
+    async def emit(event, data=None, room=None, **kwargs):
+        emitted.append((event, data))
+
+    monkeypatch.setattr(main.sio, "emit", emit)
+    monkeypatch.setattr(main, "BOSS_TICK", 0.01)
+    return emitted
+
+
+def new_fight(main, leader, *others):
+    player = {"name": "P", "avatar": "cat", "egg_skin": "d"}
+    code = main.create_party(main.PlayerData(user_id=leader, **player))["partyCode"]
+    for user_id in others:
+        main.join_party(main.JoinData(code=code, user_id=user_id, **player))
+    return code
+
+
+async def start(main, code, leader):
+    assert await main.set_game(main.SetGameData(code=code, user_id=leader, game_name="tap_boss")) == {"status": "success"}
+    return main.active_boss_fights[code]
+
+
+def boss_hp(main, code):
+    conn = main.get_db("party", readonly=True)
+    hp = conn.execute("SELECT boss_hp FROM parties WHERE code=?", (code,)).fetchone()[0]
+    conn.close()
+    return hp
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "не дождались"
+        await asyncio.sleep(0.01)
+
+
+def test_extra_sockets_do_not_multiply_the_tap_budget(main, boss, monkeypatch):
+    monkeypatch.setattr(main, "BOSS_TICK", 60)   # тик не должен успеть слить урон
+    code = new_fight(main, "boss-rate")
+
+    async def scenario():
+        fight = await start(main, code, "boss-rate")
+        for i in range(10):
+            await main.handle_tap_boss(f"rate-sid-{i}", {"roomId": code, "userId": "boss-rate", "taps": 1000, "damage": 10 ** 6})
+        main.active_boss_fights.pop(code, None)
+        return fight
+
+    fight = asyncio.run(scenario())
+    assert fight["pending"]["boss-rate"] <= main.TAP_MAX_RATE * 2 * main.TAP_MAX_DAMAGE
+    assert set(fight["tap_budget"]) == {"boss-rate"}
+
+
+def test_socket_stays_bound_to_first_player(main, boss, monkeypatch):
+    monkeypatch.setattr(main, "BOSS_TICK", 60)
+    code = new_fight(main, "boss-bind-a", "boss-bind-b")
+
+    async def scenario():
+        fight = await start(main, code, "boss-bind-a")
+        await main.handle_tap_boss("bind-sid", {"roomId": code, "userId": "boss-bind-a", "taps": 1})
+        for i in range(50):
+            await main.handle_tap_boss("bind-sid", {"roomId": code, "userId": f"fake-{i}", "taps": 1})
+        await main.handle_tap_boss("bind-sid", {"roomId": code, "userId": "boss-bind-b", "taps": 1})
+        main.active_boss_fights.pop(code, None)
+        return fight
+
+    fight = asyncio.run(scenario())
+    assert fight["pending"] == {"boss-bind-a": 1}
+
+
+def test_tick_applies_member_damage_only(main, boss):
+    code = new_fight(main, "boss-tick-a", "boss-tick-b")
+
+    async def scenario():
+        fight = await start(main, code, "boss-tick-a")
+        hp = boss_hp(main, code)
+        # до первого тика состав неизвестен — чужой урон отсеет сама запись
+        await main.handle_tap_boss("tick-a", {"roomId": code, "userId": "boss-tick-a", "taps": 3, "damage": 30})
+        await main.handle_tap_boss("tick-ghost", {"roomId": code, "userId": "ghost", "taps": 5, "damage": 50})
+        await wait_for(lambda: fight["members"] is not None)
+        # после тика состав известен — чужой отсекается ещё на сокете
+        await main.handle_tap_boss("tick-ghost-2", {"roomId": code, "userId": "ghost-2", "taps": 1})
+        await main.handle_tap_boss("tick-b", {"roomId": code, "userId": "boss-tick-b", "taps": 2, "damage": 20})
+        await wait_for(lambda: not fight["pending"] and boss_hp(main, code) == hp - 50)
+        main.active_boss_fights.pop(code, None)
+        return hp
+
+    hp = asyncio.run(scenario())
+    updates = [data for event, data in boss if event == "bossUpdate"]
+    assert updates[0]["boss_hp"] == hp - 30
+    assert updates[-1]["players"] == {"boss-tick-a": 30, "boss-tick-b": 20}
+
+
+def test_tick_survives_a_failed_write_and_skips_idle_ticks(main, boss, monkeypatch):
+    code = new_fight(main, "boss-fail")
+    real_write = main.db_write_async
+    calls = []
+
+    async def flaky_write(shard, op):
+        calls.append(shard)
+        if len(calls) == 1:
+            raise main.sqlite3.OperationalError("database is locked")
+        return await real_write(shard, op)
+
+    async def scenario():
+        fight = await start(main, code, "boss-fail")
+        monkeypatch.setattr(main, "db_write_async", flaky_write)
+        hp = boss_hp(main, code)
+        await asyncio.sleep(0.1)
+        assert calls == []   # пустые тики в БД не ходят
+        await main.handle_tap_boss("fail-sid", {"roomId": code, "userId": "boss-fail", "taps": 4, "damage": 40})
+        await wait_for(lambda: boss_hp(main, code) == hp - 40)
+        assert main.active_boss_fights.get(code) is fight   # ошибка тика не убила бой
+        main.active_boss_fights.pop(code, None)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_abandoned_fight_ends_and_can_restart(main, boss, monkeypatch):
+    monkeypatch.setattr(main, "BOSS_IDLE", 0.05)
+    code = new_fight(main, "boss-idle")
+
+    async def scenario():
+        await start(main, code, "boss-idle")
+        await wait_for(lambda: code not in main.active_boss_fights)
+        fight = await start(main, code, "boss-idle")   # новый бой — новый тик
+        await main.handle_tap_boss("idle-sid", {"roomId": code, "userId": "boss-idle", "taps": 1, "damage": 7})
+        await wait_for(lambda: not fight["pending"] and fight["members"] is not None)
+        main.active_boss_fights.pop(code, None)
+
+    asyncio.run(scenario())
+    assert boss_hp(main, code) == 10000 - 7
@@ -0,0 +1,63 @@
+# Экспедиции: итог фиксирует фоновый проход, статус только читает, claim и сброс игры итог забирают.
+import asyncio
+
+
+def new_party(main, leader, *others):
+    player = {"name": "P", "avatar": "cat", "egg_skin": "d"}
+    code = main.create_party(main.PlayerData(user_id=leader, **player))["partyCode"]
+    for user_id in others:
+        main.join_party(main.JoinData(code=code, user_id=user_id, **player))
+    return code
+
+
+def start_with_wolf(main, monkeypatch, code):
+    monkeypatch.setattr(main.random, "random", lambda: 0.0)   # волк выпадает с шансом 15%
+    end_time = main.start_expedition(main.ExpeditionStartData(code=code, location="forest"))["end_time"]
+    monkeypatch.undo()
+    return end_time
+
+
+def settle(main, now):
+    return main.db_write("party", lambda c: main.settle_expeditions(c, now))
+
+
+def party_data_version(main):
+    conn = main.get_db("party", readonly=True)
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    return conn, version
+
+
+def test_settle_then_claim(main, monkeypatch):
+    code = new_party(main, "exp-a", "exp-b")
+    end_time = start_with_wolf(main, monkeypatch, code)
+    status = main.get_party_status(code)
+    assert status["wolf_hp"] == status["wolf_max_hp"] == 40
+    main.wolf_damage(main.DamageData(code=code, user_id="exp-a", damage=40))
+
+    assert settle(main, end_time - 1) == 0   # время ещё не вышло
+    assert settle(main, end_time) >= 1
+    expected = {"score": status["expedition_score"], "location": "forest", "ended_at": end_time, "wolf": "defeated"}
+
+    # статус — только чтение: другое соединение не видит ни одной новой записи
+    conn, version = party_data_version(main)
+    assert main.get_party_status(code)["expedition_result"] == expected
+    assert main.get_party_status(code)["wolf_hp"] == 0
+    assert conn.execute("PRAGMA data_version").fetchone()[0] == version
+    conn.close()
+
+    assert main.claim_expedition(main.CodeOnly(code=code)) == {"status": "success", "result": expected}
+    status = main.get_party_status(code)
+    assert status["expedition_result"] is None and status["expedition_end"] == 0
+    assert main.claim_expedition(main.CodeOnly(code=code)) == {"status": "success", "result": None}
+
+
+def test_escaped_wolf_and_reset_to_none(main, monkeypatch):
+    code = new_party(main, "exp-none")
+    end_time = start_with_wolf(main, monkeypatch, code)
+    settle(main, end_time)
+    assert main.get_party_status(code)["expedition_result"]["wolf"] == "escaped"
+
+    assert asyncio.run(main.set_game(main.SetGameData(code=code, user_id="exp-none", game_name="none"))) == {"status": "success"}
+    status = main.get_party_status(code)
+    assert status["expedition_result"] is None and status["expedition_end"] == 0
+    assert main.claim_expedition(main.CodeOnly(code=code))["result"] is None
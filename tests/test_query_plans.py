@@ -0,0 +1,242 @@
+# Защита от регрессий в индексах. Список запросов не ведётся руками: прогоняем все эндпоинты
+# (и фоновые операции) на синтетике, ловим РЕАЛЬНО выполненные SQL через set_trace_callback
+# и для каждого смотрим EXPLAIN QUERY PLAN. Полный SCAN большой таблицы = регрессия.
+#
+# По умолчанию синтетика маленькая (план от объёма не зависит). Прогон на миллионе с замером времени
+# и отчётом по каждому запросу (SQL, план, мс; самые медленные сверху — в выводе -s и в PLAN_REPORT, TSV):
+#   DB_DIR=/tmp/plans PLAN_SEED_USERS=1000000 PLAN_REPORT=plans.tsv python -m pytest -s tests/test_query_plans.py
+import os
+import random
+import re
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+SEED_USERS = int(os.getenv("PLAN_SEED_USERS", "20000"))
+QUERY_BUDGET_MS = float(os.getenv("QUERY_BUDGET_MS", "5"))
+PLAN_REPORT = os.getenv("PLAN_REPORT")
+TIMED_INSTANCES = 5   # сколько разных подстановок одного запроса замеряем
+LARGE_TABLES = {"global_users", "syndicates", "friends", "party_invites", "players", "parties",
+                "market_lots", "market_rewards", "user_promos", "market_trades", "market_price_hist",
+                "market_hourly", "market_stats", "bit_keys"}
+# Запросы, которым полный скан разрешён: нормализованный SQL -> почему
+SCAN_OK = {
+    "SELECT * FROM market_lots ORDER BY rowid DESC": "рынок отдаётся целиком",
+}
+# Свой бюджет времени: кусок SQL -> (мс, почему)
+BUDGET_MS = {
+    "users_fts MATCH": (50, "в синтетике у всех игроков есть слово «player» — худший случай для FTS"),
+}
+# Роуты, которые обход не вызывает: путь -> почему
+NOT_SWEPT = {
+    "/api/payment/invoice": "только HTTP-запрос в Telegram, SQL нет",
+    "/api/admin/backup/create": "снапшоты идут через backup API, не запросами",
+    "/api/admin/backup/list": "только файлы в BACKUP_DIR",
+    "/api/admin/backup/verify": "только PRAGMA integrity_check",
+    "/api/admin/backup/restore": "перезаписывает базы посреди теста",
+}
+STATEMENT = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b", re.IGNORECASE)
+
+
+def seed_synthetic_data(main, users):
+    """Синтетика: users игроков + синдикаты, друзья, пати, инвайты, рынок"""
+    conn = main.get_db("profile")
+    syndicates = max(1, users // 50)
+    conn.executemany("INSERT OR IGNORE INTO syndicates (id, name, tag, leader_id, total_minutes, avatar) VALUES (?, ?, ?, ?, ?, ?)",
+                     ((f"S{i}", f"Syndicate {i}", f"T{i % 1000}", f"u{i * 50}", random.randint(0, 10 ** 6), "🐉") for i in range(syndicates)))
+    conn.executemany("INSERT OR IGNORE INTO global_users (user_id, name, avatar, level, earned, hatched, syndicate_id, syndicate_minutes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     ((f"u{i}", f"Player {i}", "cat", random.randint(1, 100), random.randint(0, 10 ** 7), random.randint(0, 500),
+                       f"S{i // 50}", random.randint(0, 10 ** 4)) for i in range(users)))
+    conn.commit()
+    main.rebuild_search_indexes(conn)
+    conn.close()
+
+    conn = main.get_db("social")
+    conn.executemany("INSERT OR IGNORE INTO friends (user_id, friend_id) VALUES (?, ?)",
+                     ((f"u{i}", f"u{random.randrange(users)}") for i in range(users) for _ in range(5)))
+    conn.executemany("INSERT INTO party_invites (sender_id, receiver_id, party_code, timestamp) VALUES (?, ?, ?, ?)",
+                     ((f"u{random.randrange(users)}", f"u{i}", str(i % 9000 + 1000), int(time.time())) for i in range(0, users, 10)))
+    conn.commit()
+    conn.close()
+
+    conn = main.get_db("party")
+    conn.executemany("INSERT OR IGNORE INTO parties (code, boss_hp, boss_max_hp, leader_id) VALUES (?, ?, ?, ?)",
+                     ((f"s{i}", 10000, 10000, f"u{i}") for i in range(max(1, users // 40))))
+    conn.executemany("INSERT OR IGNORE INTO players (user_id, party_code, name, avatar) VALUES (?, ?, ?, ?)",
+                     ((f"u{i}", f"s{i // 4}", f"Player {i}", "cat") for i in range(0, users, 10)))
+    conn.commit()
+    conn.close()
+
+    conn = main.get_db("economy")
+    conn.executemany("INSERT OR IGNORE INTO market_lots (lot_id, seller_id, seller_name, pet_id, pet_stars, price, currency) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     ((f"l{i}", f"u{i}", "seller", "cat", 1, 100, "coins") for i in range(0, users, 100)))
+    conn.executemany("INSERT INTO market_rewards (user_id, amount, currency, pet_id) VALUES (?, ?, ?, ?)",
+                     ((f"u{i}", 100, "coins", "cat") for i in range(0, users, 100)))
+    conn.executemany("INSERT OR IGNORE INTO user_promos (user_id, code) VALUES (?, ?)",
+                     ((f"u{i}", "START2026") for i in range(0, users, 3)))
+    conn.commit()
+    conn.close()
+
+
+def normalize(sql):
+    """Литералы -> ?, пробелы схлопнуты: один и тот же запрос с разными значениями считается одним"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?", "?", sql)
+    return " ".join(sql.split())
+
+
+def sweep(main, client):
+    """Вызывает каждый роут хотя бы раз, плюс фоновые операции. Возвращает шаблоны вызванных путей"""
+    called = set()
+
+    def call(method, path, json=None, params=None, **path_params):
+        called.add(path)
+        response = client.request(method, path.format(**path_params), json=json, params=params)
+        assert response.status_code < 500, (path, response.text)
+        return response.json()
+
+    a, b = "plan_a", "plan_b"
+    for user_id, name in ((a, "Plan Alpha"), (b, "Plan Beta"), (a, "Plan Gamma")):
+        call("POST", "/api/users/sync", {"user_id": user_id, "name": name, "avatar": "cat", "level": 1, "earned": 10,
+                                         "hatched": 1, "claimed_rewards": "[1, 2]", "unlocked_titles": '["t1"]'})
+    call("POST", "/api/users/rewards/claim", {"user_id": a, "reward_id": 3})
+    call("POST", "/api/users/titles/unlock", {"user_id": a, "title_id": "t2"})
+    call("GET", "/api/users/progress/{user_id}", user_id=a)
+
+    syn_id = call("POST", "/api/syndicates/create", {"user_id": a, "name": "Plan Clan", "tag": "PLN", "avatar": "x"})["syndicate_id"]
+    call("POST", "/api/syndicates/join", {"user_id": b, "syndicate_id": syn_id})
+    call("POST", "/api/syndicates/edit", {"user_id": a, "name": "Plan Clan 2", "tag": "PL2", "avatar": "x"})
+    call("POST", "/api/syndicates/add_minutes", {"user_id": b, "minutes": 30})
+    call("GET", "/api/syndicates/top")
+    call("GET", "/api/syndicates/info/{syndicate_id}", syndicate_id=syn_id)
+    call("GET", "/api/syndicates/my/{user_id}", user_id=b)
+    call("GET", "/api/search/syndicates", params={"q": "plan cl"})
+    call("GET", "/api/search/players", params={"q": "player 12"})
+    call("GET", "/api/forbes/{user_id}", user_id=a)
+    call("POST", "/api/syndicates/leave", {"user_id": b})
+    call("POST", "/api/syndicates/leave", {"user_id": a})
+
+    call("POST", "/api/friends/add", {"user_id": a, "friend_id": b})
+    call("GET", "/api/friends/list/{user_id}", user_id=a)
+    call("POST", "/api/invites/send", {"sender_id": a, "receiver_id": b, "party_code": "0000"})
+    invite = call("GET", "/api/invites/check/{user_id}", user_id=b)
+    call("POST", "/api/invites/clear", {"code": str(invite["invite"]["id"])})
+
+    lot_id = call("POST", "/api/market/sell", {"seller_id": a, "seller_name": "A", "pet_id": "cat", "pet_stars": 1,
+                                               "price": 100, "currency": "coins"})["lot_id"]
+    call("GET", "/api/market/list")
+    call("POST", "/api/market/buy", {"lot_id": lot_id, "buyer_id": b})
+    call("GET", "/api/market/rewards/{user_id}", user_id=a)
+    call("GET", "/api/market/stats", params={"pet_id": "cat"})
+    call("GET", "/api/market/stats", params={"pet_id": "cat", "pet_stars": 1, "currency": "coins"})
+
+    call("POST", "/api/admin/promo/create", {"password": main.ADMIN_PASSWORD, "code": "PLAN1", "type": "money",
+                                             "val": 1, "max_uses": 0})
+    call("POST", "/api/promo/activate", {"user_id": a, "code": "PLAN1"})
+    call("POST", "/api/admin/admission", {"password": main.ADMIN_PASSWORD})
+    call("POST", "/api/admin/bitset/register", {"password": main.ADMIN_PASSWORD, "kind": "title", "keys": ["plan_vip"]})
+    call("POST", "/api/craft/mutate", {"pet1": "kitten", "pet1_stars": 1, "pet2": "kitten", "pet2_stars": 1, "catalyst": "luck"})
+
+    player = {"name": "A", "avatar": "dragon", "egg_skin": "d"}
+    code = call("POST", "/api/party/create", {"user_id": a, **player})["partyCode"]
+    call("POST", "/api/party/join", {"code": code, "user_id": b, **player})
+    call("GET", "/api/party/status/{code}", code=code)
+    call("POST", "/api/party/set_game", {"code": code, "user_id": a, "game_name": "tap_boss"})
+    call("POST", "/api/party/damage", {"code": code, "user_id": b, "damage": 5})
+    main.db_write("party", main.boss_damage_op(code, {a: 5, "stranger": 5}))   # тик Тап-Босса
+    call("POST", "/api/party/mega_egg/add", {"code": code, "seconds": 60})
+    call("POST", "/api/party/mega_egg/claim", {"code": code})
+    call("POST", "/api/party/radar", {"code": code})
+    call("POST", "/api/party/expedition/start", {"code": code, "location": "forest"})
+    call("POST", "/api/party/expedition/wolf_damage", {"code": code, "user_id": b, "damage": 1})
+    main.db_write("party", lambda c: main.settle_expeditions(c, int(time.time()) + 10 ** 6))   # фоновый расчёт
+    call("POST", "/api/party/expedition/claim", {"code": code})
+    call("POST", "/api/party/set_game", {"code": code, "user_id": a, "game_name": "none"})
+    call("POST", "/api/party/leave", {"user_id": b, **player})
+    call("POST", "/api/party/leave", {"user_id": a, **player})
+    return called
+
+
+@pytest.fixture(scope="module")
+def captured(main, fastapi_app):
+    """Обходит приложение, записывая (шард, attach, SQL) каждого выполненного запроса"""
+    seed_synthetic_data(main, SEED_USERS)
+    statements = []
+    original_get_db = main.get_db
+
+    def traced_get_db(shard, attach=(), readonly=False):
+        conn = original_get_db(shard, attach=attach, readonly=readonly)
+        conn.set_trace_callback(lambda sql: statements.append((shard, tuple(attach), sql)))
+        return conn
+
+    main.get_db = traced_get_db
+    main.db_writers.clear()   # писатели открывают соединения заново — уже с трассировкой
+    try:
+        with TestClient(fastapi_app) as client:
+            called = sweep(main, client)
+    finally:
+        main.get_db = original_get_db
+        main.db_writers.clear()
+    return called, statements
+
+
+def test_sweep_covers_every_route(fastapi_app, captured):
+    called, _ = captured
+    routes = {route.path for route in fastapi_app.routes
+              if route.path.startswith("/api/") and not route.path.startswith("/api/api/")}
+    missing = routes - called - set(NOT_SWEPT)
+    assert not missing, f"Новые роуты не попали в обход sweep(): {sorted(missing)}"
+
+
+def test_no_full_scans_of_large_tables(main, captured):
+    _, statements = captured
+    unique = {}   # шаблон -> до TIMED_INSTANCES разных подстановок (поиск: точный и префиксный запрос — один шаблон)
+    for shard, attach, sql in statements:
+        if STATEMENT.match(sql):
+            instances = unique.setdefault((shard, attach, normalize(sql)), [])
+            if sql not in instances and len(instances) < TIMED_INSTANCES:
+                instances.append(sql)
+    assert len(unique) > 50
+
+    problems = []
+    report = []
+    for (shard, attach, key), instances in sorted(unique.items()):
+        sql = instances[0]
+        conn = main.get_db(shard, attach=attach, readonly=True)
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        aliases = {alias: table for table, alias in re.findall(r"(?:FROM|JOIN)\s+(\w+)\s+(\w+)", sql)}
+        scans = [step for step in plan
+                 if step.startswith("SCAN ") and "USING" not in step
+                 and aliases.get(step.split()[1], step.split()[1]) in LARGE_TABLES]
+        elapsed_ms = None
+        if sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            for instance in instances:   # худшая из подстановок
+                started = time.perf_counter()
+                conn.execute(instance).fetchall()
+                elapsed_ms = max(elapsed_ms or 0, (time.perf_counter() - started) * 1000)
+        conn.close()
+        report.append((elapsed_ms, shard, key, plan))
+        if key in SCAN_OK:
+            continue
+        if scans:
+            problems.append(f"SCAN: {key}\n    {' | '.join(plan)}")
+        elif elapsed_ms is not None and elapsed_ms > next((ms for part, (ms, _) in BUDGET_MS.items() if part in key), QUERY_BUDGET_MS):
+            problems.append(f"SLOW {elapsed_ms:.1f}ms: {key}\n    {' | '.join(plan)}")
+    write_report(report)
+    assert not problems, "\n".join(problems)
+
+
+def write_report(report):
+    """Время каждого запроса: в stdout (видно с -s и при падении) и в TSV, если задан PLAN_REPORT"""
+    report.sort(key=lambda row: -1 if row[0] is None else row[0], reverse=True)
+    print(f"\nПланы запросов: {len(report)} шт., пользователей в синтетике: {SEED_USERS}")
+    for elapsed_ms, shard, key, plan in report:
+        ms = "  write" if elapsed_ms is None else f"{elapsed_ms:7.2f}"
+        print(f"{ms} ms  [{shard}] {key}\n             {' | '.join(plan)}")
+    if PLAN_REPORT:
+        with open(PLAN_REPORT, "w", encoding="utf-8") as f:
+            f.write("ms\tshard\tsql\tplan\n")
+            for elapsed_ms, shard, key, plan in report:
+                ms = "" if elapsed_ms is None else f"{elapsed_ms:.3f}"
+                f.write(f"{ms}\t{shard}\t{key}\t{' | '.join(plan)}\n")
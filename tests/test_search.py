@@ -0,0 +1,72 @@
+# Поиск игроков и синдикатов (FTS5): ранжирование и поддержка индекса при изменениях.
+import pytest
+
+
+def sync(main, user_id, name):
+    assert main.sync_global_user(main.GlobalUserSync(user_id=user_id, name=name, avatar="a", level=1, earned=0,
+                                                     hatched=0)) == {"status": "success"}
+
+
+def player_ids(main, q, page=0):
+    return [row["user_id"] for row in main.search_players(q, page)["results"]]
+
+
+def syndicate_ids(main, q):
+    return [row["id"] for row in main.search_syndicates(q)["results"]]
+
+
+@pytest.fixture(scope="module")
+def crowd_rows(main):
+    """Толпа «Zorblax Smith N», созданных раньше игрока с именем ровно «Zorblax»"""
+    count = 1000
+
+    def op(c):
+        c.executemany("INSERT INTO global_users (user_id, name, avatar) VALUES (?, ?, 'a')",
+                      [(f"crowd-{i}", f"Zorblax Smith {i}") for i in range(count)])
+        for i in range(count):
+            main.search_index(c, "global_users", f"crowd-{i}")
+
+    main.db_write("profile", op)
+    sync(main, "crowd-exact", "Zorblax")
+
+
+@pytest.fixture
+def crowd(main, crowd_rows, monkeypatch):
+    monkeypatch.setattr(main, "SEARCH_CANDIDATES", 300)   # кандидатов меньше, чем «Zorblax …» в толпе
+
+
+def test_exact_name_beats_older_prefix_matches(main, crowd):
+    assert player_ids(main, "zorblax")[0] == "crowd-exact"
+    assert player_ids(main, "Zorblax!")[0] == "crowd-exact"
+
+
+def test_prefix_still_finds_and_pages(main, crowd):
+    first = main.search_players("zorbl")
+    assert len(first["results"]) == main.SEARCH_PAGE and first["has_more"]
+    assert set(player_ids(main, "zorbl")).isdisjoint(player_ids(main, "zorbl", page=1))
+    # полное имя стоит выше тех, где совпал только префикс последнего слова
+    assert player_ids(main, "zorblax smith 7")[0] == "crowd-7"
+
+
+def test_player_rename_updates_index(main):
+    sync(main, "search-rename", "Quillfeather")
+    assert player_ids(main, "quillfeather") == ["search-rename"]
+    sync(main, "search-rename", "Brightmoss")
+    assert player_ids(main, "quillfeather") == []
+    assert player_ids(main, "brightmoss") == ["search-rename"]
+
+
+def test_syndicate_create_edit_leave_update_index(main):
+    sync(main, "search-leader", "Leader")
+    created = main.create_syndicate(main.SyndicateCreate(user_id="search-leader", name="Velvet Hammers",
+                                                         tag="VLVT", avatar="a"))
+    syn_id = created["syndicate_id"]
+    assert syndicate_ids(main, "velvet") == [syn_id]
+    assert syndicate_ids(main, "vlvt") == [syn_id]
+
+    main.edit_syndicate(main.SyndicateCreate(user_id="search-leader", name="Copper Owls", tag="COWL", avatar="a"))
+    assert syndicate_ids(main, "velvet") == [] and syndicate_ids(main, "vlvt") == []
+    assert syndicate_ids(main, "copper owls") == [syn_id]
+
+    main.leave_syndicate(main.SyndicateLeave(user_id="search-leader"))
+    assert syndicate_ids(main, "copper") == []